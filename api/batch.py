@@ -0,0 +1,144 @@
+"""
+多租户批量计算：每个租户有自己的目录（config.yaml 和 .cache_data），在独立的子进程中计算
+
+- 同时运行的子进程数不超过 max_workers
+- 每个子进程可以设置内存上限（Unix 下用 RLIMIT_AS），超限时只有这个租户失败
+- 子进程异常退出或被系统杀掉也只影响该租户，其余租户照常完成
+- 每个租户的输出写到自己的 batch.log，不会和其他租户交错
+"""
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import yaml
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，内存上限不生效
+    resource = None
+
+DONE, FAILED = "done", "failed"
+DEFAULT_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+DEFAULT_MEMORY_MB = 4096
+LOG_NAME = "batch.log"
+
+
+def load_manifest(path):
+    """
+    读取租户清单，相对路径都按清单所在目录解析，例如：
+
+        max_workers: 4
+        memory_mb: 4096          # 每个租户的内存上限，null 表示不限制
+        out: reports             # 每个租户的报表写到 reports/<name>
+        method: average
+        tenants:
+          - name: alice
+            dir: tenants/alice   # 包含 config.yaml 和 .cache_data
+          - name: bob
+            dir: /srv/bob
+            memory_mb: 8192      # 单独覆盖清单级别的配置
+
+    返回 (tenants, max_workers)，每个租户为 dict，包含 name, dir, config, out, memory_mb 等
+    """
+    path = Path(path).resolve()
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = yaml.safe_load(f) or {}
+    root = path.parent
+    defaults = {k: v for k, v in manifest.items() if k not in ("tenants", "max_workers", "out")}
+    defaults.setdefault("memory_mb", DEFAULT_MEMORY_MB)
+    out_root = root / manifest.get("out", "reports")
+
+    tenants, names = [], set()
+    for entry in manifest.get("tenants") or []:
+        name = str(entry["name"])
+        if name in names:
+            raise ValueError(f"租户名称重复: {name}")
+        names.add(name)
+        tenant = {**defaults, **entry, "name": name}
+        tenant["dir"] = str((root / entry.get("dir", name)).resolve())
+        tenant["config"] = str(Path(tenant["dir"]) / entry.get("config", "config.yaml"))
+        tenant["out"] = str((root / entry["out"]).resolve() if "out" in entry else out_root / name)
+        tenants.append(tenant)
+    return tenants, int(manifest.get("max_workers", DEFAULT_MAX_WORKERS))
+
+
+def _limit_memory(memory_mb):
+    if resource is None or not memory_mb:
+        return
+    limit = int(memory_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _peak_mib():
+    if resource is None:
+        return None
+    # Linux 下 ru_maxrss 单位为 KiB，macOS 下为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _child(task, tenant, conn):
+    """子进程入口：设置内存上限，切换到租户目录，输出重定向到租户日志"""
+    Path(tenant["out"]).mkdir(parents=True, exist_ok=True)
+    log = open(Path(tenant["out"]) / LOG_NAME, "w", encoding="utf-8", buffering=1)
+    sys.stdout = sys.stderr = log
+    try:
+        _limit_memory(tenant.get("memory_mb"))
+        os.chdir(tenant["dir"])
+        result = task(tenant)
+        conn.send((DONE, result, _peak_mib()))
+    except BaseException as e:
+        traceback.print_exc()
+        conn.send((FAILED, f"{type(e).__name__}: {e}", _peak_mib()))
+    finally:
+        conn.close()
+        log.flush()
+
+
+def _run_one(task, tenant, mp_context):
+    started = time.perf_counter()
+    receiver, sender = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(target=_child, args=(task, tenant, sender),
+                                 name=f"tenant-{tenant['name']}")
+    process.start()
+    sender.close()
+    try:
+        state, payload, peak = receiver.recv()
+    except EOFError:
+        # 子进程没有发回结果就退出了（段错误、被 OOM killer 杀掉等）
+        state, payload, peak = FAILED, None, None
+    process.join()
+    if state == FAILED and payload is None:
+        payload = f"子进程异常退出，退出码 {process.exitcode}"
+    return {
+        "name": tenant["name"],
+        "state": state,
+        "seconds": round(time.perf_counter() - started, 2),
+        "peak_mib": peak,
+        "result": payload if state == DONE else None,
+        "message": payload if state == FAILED else "",
+        "log": str(Path(tenant["out"]) / LOG_NAME),
+    }
+
+
+def run_batch(tenants, task, max_workers=DEFAULT_MAX_WORKERS, on_done=None):
+    """
+    每个租户在独立的子进程中执行 task(tenant)，同时最多 max_workers 个
+    task 必须是可以被 pickle 的顶层函数，返回值会原样放进结果的 result 字段；
+    on_done(结果) 在每个租户结束时回调。返回按清单顺序排列的结果列表
+    """
+    # spawn 启动干净的解释器：不继承父进程的线程和模块级缓存，各平台行为一致
+    mp_context = multiprocessing.get_context("spawn")
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tenant") as pool:
+        futures = [pool.submit(_run_one, task, tenant, mp_context) for tenant in tenants]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["name"]] = result
+            if on_done is not None:
+                on_done(result)
+    return [results[t["name"]] for t in tenants]
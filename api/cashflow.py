@@ -0,0 +1,122 @@
+import re
+import numpy as np
+import pandas as pd
+from . import metrics
+from .store import read_table
+
+# 分类规则按顺序匹配，先命中的优先；匹配对象是大写后的备注 / 流水名称
+CATEGORY_RULES = [
+    ("adr_fee", r"ADR"),
+    ("stamp_duty", r"STAMP"),
+    ("withholding_tax", r"WITHHOLDING TAX|DIVIDENDS? TAX"),
+    ("dividend", r"DIVIDEND"),
+    ("interest", r"INTEREST|LOAN"),
+    ("platform_fee", r"FEE|IRO|REGISTRATION"),
+    ("tax", r"TAX"),
+]
+# 长桥的 transaction_flow_name 是固定名称，ADR 费只认整名 "ADR Fee"
+LONGPORT_CATEGORY_RULES = [("adr_fee", r"^ADR FEE$")] + CATEGORY_RULES[1:]
+OTHER = "other"
+CATEGORIES = [name for name, _ in CATEGORY_RULES] + [OTHER]
+
+# 除“其他”以外都是费用类流水，富途按类别分别记账（见 user_futu.FEE_ACCOUNTS）
+FEE_CATEGORIES = [name for name, _ in CATEGORY_RULES]
+
+# 描述中的代码，例如 "BABA.US ADR Fee"
+SYMBOL_PATTERN = re.compile(r"([A-Z0-9]+(?:\.[A-Z]+)+)")
+# 长桥 ADR 费描述里紧跟 "ADR" 的代码
+LONGPORT_ADR_SYMBOL_PATTERN = re.compile(r"([A-Z0-9]+\.[A-Z]+)\s+ADR")
+
+
+def _compile(rules):
+    return [(name, re.compile(pattern)) for name, pattern in rules]
+
+
+_compiled_rules = _compile(CATEGORY_RULES)
+_longport_rules = _compile(LONGPORT_CATEGORY_RULES)
+
+
+def _by_unique(values, fn):
+    """
+    先对列去重，只在不同的取值上计算 fn，再按编号映射回每一行
+    流水备注高度重复，百万行的文件通常只有几百种不同的文本
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    result = np.asarray(fn(pd.Series(uniques, dtype=object)), dtype=object)
+    out = np.full(len(codes), None, dtype=object)
+    hit = codes >= 0
+    out[hit] = result[codes[hit]]
+    return out
+
+
+def classify(text, rules=None):
+    """逐行返回类别，匹配不到的为 other；rules 为编译好的 (类别, 正则) 列表"""
+    rules = _compiled_rules if rules is None else rules
+
+    def run(uniques):
+        upper = uniques.fillna("").astype(str).str.upper()
+        conditions = [upper.str.contains(pattern, regex=True).to_numpy()
+                      for _, pattern in rules]
+        return np.select(conditions, [name for name, _ in rules], default=OTHER)
+
+    labels = _by_unique(text, run)
+    labels[pd.isna(labels)] = OTHER
+    return pd.Categorical(labels, categories=CATEGORIES)
+
+
+def extract_symbols(text, pattern=SYMBOL_PATTERN, upper=False):
+    """逐行从文本中抽取第一个代码，抽取不到为 None"""
+    def run(uniques):
+        uniques = uniques.fillna("").astype(str)
+        if upper:
+            uniques = uniques.str.upper()
+        found = uniques.str.extract(pattern, expand=False)
+        return found.where(found.notna(), None)
+
+    return _by_unique(text, run)
+
+
+def _event_table(time, currency, category, symbol, amount, time_format=None):
+    """统一的事件表：time, year, currency, category, symbol, amount"""
+    time = pd.to_datetime(pd.Series(time).reset_index(drop=True), format=time_format, errors="coerce")
+    return pd.DataFrame({
+        "time": time,
+        "year": time.dt.year.astype("Int64"),
+        "currency": _by_unique(currency, lambda u: u.astype(str).str.upper()),
+        "category": category,
+        "symbol": symbol,
+        "amount": pd.to_numeric(pd.Series(amount).reset_index(drop=True), errors="coerce"),
+    })
+
+
+@metrics.timed("cashflow.classify.futu")
+def futu_cash_events(source, use_store=True):
+    """
+    富途现金流水 -> 事件表
+    amount 保持富途的符号：负数为扣费，正数为退款或入账
+    """
+    df = read_table(source, "futu_cash", use_store=use_store)
+    remark = df["cashflow_remark"]
+    events = _event_table(df["clearing_date"], df["currency"], classify(remark),
+                          extract_symbols(remark, upper=True),
+                          df["cashflow_amount"])
+    metrics.incr("rows.cashflow", len(events))
+    return events
+
+
+@metrics.timed("cashflow.classify.longport")
+def longport_cash_events(source, use_store=True):
+    """
+    长桥现金流水 -> 事件表
+    类别取自 transaction_flow_name；symbol 优先取字段，为空时从 description 中抽取
+    """
+    df = read_table(source, "longport_cash", use_store=use_store)
+    field = df["symbol"].astype("string").reset_index(drop=True)
+    symbol = np.where((field.notna() & (field != "")).to_numpy(dtype=bool),
+                      field.to_numpy(dtype=object),
+                      extract_symbols(df["description"], LONGPORT_ADR_SYMBOL_PATTERN))
+    events = _event_table(df["business_time"], df["currency"],
+                          classify(df["transaction_flow_name"], _longport_rules), symbol,
+                          df["balance"], time_format="ISO8601")
+    metrics.incr("rows.cashflow", len(events))
+    return events
@@ -0,0 +1,125 @@
+import hashlib
+import pickle
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .engine import ENGINE_VERSION, TRADE_COLUMNS, make_engine
+
+# 时间无法解析的成交排在最后，归入一个不会生成检查点的“年份”
+NO_YEAR = 9999
+
+
+def _year_slices(frames):
+    """把按时间排好序的引擎输入切成 (year, DataFrame)，同一年可能跨多个块"""
+    for frame in frames:
+        if len(frame) == 0:
+            continue
+        years = pd.to_datetime(frame["updated_at"]).dt.year \
+            .fillna(NO_YEAR).astype(int).to_numpy()
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(years)) + 1, [len(years)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            yield int(years[start]), frame.iloc[start:end]
+
+
+def _walk(frames):
+    """
+    依次产出 ("slice", year, df) 和 ("boundary", year, digest)
+    digest 是该年年末之前所有成交记录的链式哈希，任何更早的记录变化都会改变它
+    """
+    h = hashlib.sha1()
+    current = None
+    for year, part in _year_slices(frames):
+        if current is not None and year != current:
+            yield "boundary", current, h.hexdigest()
+        current = year
+        h.update(pd.util.hash_pandas_object(part[TRADE_COLUMNS], index=False).to_numpy().tobytes())
+        yield "slice", year, part
+
+
+class YearCheckpoints:
+    """
+    年末持仓检查点
+
+    每个完整年份结束时保存一次引擎状态（持仓数量、成本、币种、FIFO 批次和累计的年度收益），
+    文件名带有截至该年末所有记录的哈希；下次计算时恢复最近一个哈希仍然匹配的检查点，
+    只回放它之后的成交
+    """
+
+    def __init__(self, directory, tag, method="average"):
+        self.method = method
+        self.directory = Path(directory) / f"{tag}-{method}-v{ENGINE_VERSION}"
+
+    def _index(self):
+        index = {}
+        if self.directory.exists():
+            for path in self.directory.glob("*.pkl"):
+                year, _, digest = path.stem.partition("-")
+                index[int(year)] = (digest, path)
+        return index
+
+    def _save(self, year, digest, engine):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{year}-{digest}.pkl"
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(engine, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(path)
+
+    def _find_restore_point(self, frames, index):
+        restore = None
+        for kind, year, payload in _walk(frames):
+            if kind != "boundary":
+                continue
+            entry = index.get(year)
+            if entry is None:
+                continue
+            if entry[0] != payload:
+                # 链式哈希不一致，说明这一年或更早的记录变了，之后的检查点都不可用
+                break
+            restore = year
+        return restore
+
+    def run(self, make_frames):
+        """
+        make_frames 每次调用返回一个新的引擎输入迭代器（按时间排序），会被遍历两次：
+        第一次只计算哈希找到可用的检查点，第二次从检查点之后开始回放
+        """
+        index = self._index()
+        restore = self._find_restore_point(make_frames(), index) if index else None
+
+        if restore is not None:
+            with open(index[restore][1], "rb") as f:
+                engine = pickle.load(f)
+            print(f"从 {restore} 年末检查点恢复，只回放之后的成交")
+        else:
+            engine = make_engine(self.method)
+
+        # 恢复点之后的检查点要么失效要么会被重新生成
+        for year, (_, path) in index.items():
+            if restore is None or year > restore:
+                path.unlink(missing_ok=True)
+
+        for kind, year, payload in _walk(make_frames()):
+            if restore is not None and year <= restore:
+                continue
+            if kind == "slice":
+                engine.feed(payload)
+            elif year != NO_YEAR:
+                self._save(year, payload, engine)
+        return engine
+
+
+def run_engine(make_frames, method="average", checkpoint_dir=None, tag="default"):
+    """把成交回放进引擎；提供 checkpoint_dir 时使用年末检查点做增量计算"""
+    if checkpoint_dir is None:
+        engine = make_engine(method)
+        for frame in make_frames():
+            engine.feed(frame)
+        return engine
+    return YearCheckpoints(checkpoint_dir, tag, method).run(make_frames)
+
+
+def source_tag(prefix, source):
+    """用数据文件的绝对路径区分不同的检查点目录"""
+    digest = hashlib.sha1(str(Path(source).resolve()).encode("utf-8")).hexdigest()[:10]
+    return f"{prefix}-{digest}"
@@ -0,0 +1,211 @@
+"""
+下载结果与本地 CSV 缓存的去重合并
+
+每个缓存文件旁边有一个 SQLite 键索引（{csv}.keys.sqlite），保存每行去重键的 64 位哈希。
+新下载的数据只需要查索引、追加写入文件末尾，耗时与新数据行数成正比，
+不再读入、排序和重写全部历史。索引与文件的大小 / 修改时间不一致时（例如手工编辑过 CSV）
+会自动从文件重建一次。
+
+哈希基于行在 CSV 中的文本形式计算，接口返回的 int / Decimal / datetime
+和从文件读回的字符串得到相同的键。
+"""
+import io
+import os
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from . import metrics
+from .utils import safe_read_csv, sniff_encoding
+
+# 每种缓存的键索引：第一个为去重键，其余只用于查询（例如富途按订单判断手续费是否已计入）
+# 列为 None 表示用整行内容的组合哈希（长桥现金流水没有流水号）
+INDEXES = {
+    "futu_trade": {"deal": ["deal_id"], "order": ["order_id"]},
+    "futu_cash": {"cashflow": ["acc_id", "cashflow_id"]},
+    "longport_trade": {"order": ["order_id"]},
+    "longport_cash": {"row": None},
+}
+
+_BATCH = 50_000
+
+
+def _index_path(path):
+    return f"{path}.keys.sqlite"
+
+
+def as_text(df):
+    """转成与写入 CSV 后再读回完全一致的字符串表，缺失值为空字符串"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer, dtype=str, keep_default_na=False)
+
+
+def row_keys(text, columns=None):
+    """按 columns（None 为全部列，与列顺序无关）计算每行的 uint64 哈希"""
+    if columns is None:
+        columns = sorted(text.columns)
+    return pd.util.hash_pandas_object(text[columns], index=False).to_numpy(dtype=np.uint64)
+
+
+def unique_rows(df, kind):
+    """
+    按去重键删除一次下载结果内部的重复行（例如相邻窗口在边界上重叠），保留最后一次
+    整行哈希的数据不在批次内去重：同一批返回的两条相同流水可能是真实的两笔
+    """
+    columns = next(iter(INDEXES[kind].values()))
+    if columns is None or df.empty or not set(columns) <= set(df.columns):
+        return df
+    keys = row_keys(as_text(df[columns]), columns)
+    return df[~pd.Series(keys).duplicated(keep="last").to_numpy()]
+
+
+class KeyIndex:
+    """一个 CSV 缓存文件的持久化键索引"""
+
+    def __init__(self, path, kind):
+        self.path = Path(path)
+        self.kind = kind
+        self.indexes = INDEXES[kind]
+        self.conn = sqlite3.connect(_index_path(path))
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            for name in self.indexes:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS keys_{name} (h INTEGER PRIMARY KEY)")
+        if self._stored_fingerprint() != self._fingerprint():
+            self.rebuild()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fingerprint(self):
+        if not self.path.exists():
+            return ""
+        stat = self.path.stat()
+        return f"{self.kind}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _stored_fingerprint(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        return row[0] if row else None
+
+    def _save_fingerprint(self):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)",
+                          (self._fingerprint(),))
+
+    def keys(self, text, name):
+        columns = self.indexes[name]
+        if columns is not None and not set(columns) <= set(text.columns):
+            return None
+        return row_keys(text, columns)
+
+    def rebuild(self):
+        """从 CSV 全量重建索引，只在索引缺失或文件被外部修改时发生"""
+        with metrics.span("dedup.rebuild", path=str(self.path)), self.conn:
+            for name in self.indexes:
+                self.conn.execute(f"DELETE FROM keys_{name}")
+            if self.path.exists() and self.path.stat().st_size > 0:
+                text = safe_read_csv(self.path, dtype=str, keep_default_na=False)
+                self._insert(text)
+            self._save_fingerprint()
+
+    def _insert(self, text):
+        for name in self.indexes:
+            keys = self.keys(text, name)
+            if keys is None:
+                continue
+            values = keys.view(np.int64).tolist()
+            for i in range(0, len(values), _BATCH):
+                self.conn.executemany(f"INSERT OR IGNORE INTO keys_{name} VALUES (?)",
+                                      ((v,) for v in values[i:i + _BATCH]))
+
+    def contains(self, df, name):
+        """df 的每一行按索引 name 的键是否已在缓存中，df 可以是接口返回的原始数据"""
+        columns = self.indexes[name]
+        return self.seen(row_keys(as_text(df[columns] if columns else df), columns), name)
+
+    def seen(self, keys, name):
+        """逐个返回键是否已在索引中"""
+        found = set()
+        values = np.unique(keys).view(np.int64).tolist()
+        for i in range(0, len(values), 900):
+            batch = values[i:i + 900]
+            rows = self.conn.execute(
+                f"SELECT h FROM keys_{name} WHERE h IN ({', '.join('?' * len(batch))})", batch)
+            found.update(r[0] for r in rows)
+        if not found:
+            return np.zeros(len(keys), dtype=bool)
+        return np.isin(keys.view(np.int64), np.fromiter(found, dtype=np.int64, count=len(found)))
+
+    def append(self, text):
+        """把字符串表追加到 CSV 末尾并登记键；列与已有表头不一致时整体重写"""
+        header = None
+        if self.path.exists() and self.path.stat().st_size > 0:
+            encoding = sniff_encoding(self.path)
+            header = list(pd.read_csv(self.path, nrows=0, encoding=encoding).columns)
+        with self.conn:
+            if header is not None and set(text.columns) <= set(header) and encoding != "gb18030":
+                _ensure_trailing_newline(self.path)
+                text.reindex(columns=header, fill_value="").to_csv(
+                    self.path, mode="a", header=False, index=False, encoding="utf-8")
+                self._insert(text)
+            else:
+                if header is not None:
+                    existing = safe_read_csv(self.path, dtype=str, keep_default_na=False)
+                    text = pd.concat([existing, text], ignore_index=True).fillna("")
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                text.to_csv(self.path, index=False, encoding="utf-8-sig")
+                for name in self.indexes:
+                    self.conn.execute(f"DELETE FROM keys_{name}")
+                self._insert(text)
+            self._save_fingerprint()
+
+
+def _ensure_trailing_newline(path):
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) not in (b"\n", b"\r"):
+            f.write(b"\n")
+
+
+def append_new(path, df, kind, prepare=None):
+    """
+    把 df 中去重键尚未出现在缓存里的行追加到 CSV，返回实际追加的行
+    已存在的行保持原样（成交和流水下载后不会再变化）；
+    prepare(新行, 索引) 在写入前调用，可以根据索引调整新行，返回调整后的 DataFrame
+    """
+    if df is None or df.empty:
+        return df
+    received = len(df)
+    with metrics.span("dedup.append", path=str(path), rows=len(df)), KeyIndex(path, kind) as index:
+        df = unique_rows(df, kind)
+        text = as_text(df)
+        name = next(iter(index.indexes))
+        keys = index.keys(text, name)
+        if keys is not None:
+            fresh = ~index.seen(keys, name)
+            text, df = text[fresh].reset_index(drop=True), df[fresh].reset_index(drop=True)
+        if prepare is not None and len(df):
+            df = prepare(df, index)
+            text = as_text(df)
+        if len(text):
+            index.append(text)
+    metrics.incr(f"rows.dedup.{kind}.appended", len(df))
+    print(f"{path}: 新增 {len(df)} 行，跳过重复 {received - len(df)} 行")
+    return df
+
+
+def write_all(path, df, kind):
+    """覆盖写入整份缓存并重建索引（全量下载时使用），批次内的重复行先按去重键删除"""
+    df = unique_rows(df, kind)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False, encoding="utf-8-sig")
+    with KeyIndex(path, kind):
+        pass
+    return df
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from . import metrics
+from .ledger import PositionLedger
+
+# 计算逻辑变化时递增，使旧的结果缓存失效
+ENGINE_VERSION = 7
+
+# 引擎输入的标准列，两个券商的格式化函数都先转换成这个结构
+TRADE_COLUMNS = ["symbol", "currency", "is_sell",
+                 "price", "qty", "fee", "updated_at", "shares"]
+
+
+class CostBasisEngine:
+    """
+    批量移动平均成本引擎，语义与 Stock.buy / Stock.sell 完全一致
+
+    输入整张按时间排好序的成交表，按 symbol 分组后用 NumPy 数组计算
+    持仓、成本、已实现收益和年度汇总，状态保存在 PositionLedger 中，
+    最终输出与原来相同的 {symbol: Stock} 结构
+    """
+
+    def __init__(self, ledger=None):
+        self.ledger = ledger if ledger is not None else PositionLedger()
+
+    def feed(self, trades):
+        """处理一批成交，trades 需包含 TRADE_COLUMNS 且已按时间升序"""
+        if len(trades) == 0:
+            return
+        with metrics.span("engine.feed", rows=len(trades)):
+            self._feed(trades)
+        metrics.incr("rows.engine", len(trades))
+
+    def _feed(self, trades):
+        ledger = self.ledger
+
+        codes, uniques = pd.factorize(trades["symbol"], sort=False)
+        currency = trades["currency"].to_numpy()
+        is_sell = trades["is_sell"].to_numpy(dtype=bool)
+        price = trades["price"].to_numpy(dtype=float)
+        qty = trades["qty"].to_numpy(dtype=float)
+        fee = trades["fee"].to_numpy(dtype=float)
+        shares = trades["shares"].to_numpy(dtype=float)
+        # 年份只在这里派生一次，之后全部按 int 处理
+        times = pd.to_datetime(trades["updated_at"])
+        years = times.dt.year.to_numpy()
+
+        # factorize 的 uniques 按首次出现排序，与原来 pool 的插入顺序一致
+        first = np.unique(codes, return_index=True)[1]
+        code_sids = ledger.sids(uniques, currency[first])
+
+        # 手续费折算进单价：买入加、卖出减
+        true_price = price * shares + np.where(is_sell, -fee, fee) / qty
+
+        # 稳定排序：同一 symbol 的成交保持时间顺序
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(order)]))
+
+        realized = np.zeros(len(trades), dtype=float)
+
+        for start, end in zip(starts, ends):
+            idx = order[start:end]
+            self.replay(code_sids[sorted_codes[start]],
+                        is_sell[idx].tolist(),
+                        qty[idx].tolist(),
+                        true_price[idx].tolist(),
+                        realized, idx.tolist())
+
+        ledger.add_realized(code_sids[codes], years, realized, times)
+
+    def replay(self, sid, sides, qtys, prices, realized, rows):
+        """回放单个 symbol 的一组成交，已实现收益写入 realized[rows]"""
+        ledger = self.ledger
+        ledger.qty[sid], ledger.cost[sid] = _replay(
+            float(ledger.qty[sid]), float(ledger.cost[sid]),
+            sides, qtys, prices, realized, rows)
+
+    def close_out(self, sid, year, time=None):
+        """按零价值平掉 symbol 的全部持仓（期权到期），返回计入的收益"""
+        return self.ledger.close_out(sid, year, time)
+
+    def to_pool(self):
+        return self.ledger.to_pool()
+
+
+def _replay(pos_qty, pos_cost, sides, qtys, prices, realized, rows):
+    """按时间顺序回放单个 symbol 的成交，返回最终 (qty, cost)"""
+    for sell, q, tp, row in zip(sides, qtys, prices, rows):
+        if sell:
+            # ---- 先平多 ----
+            if pos_qty > 0:
+                close = min(q, pos_qty)
+                avg = pos_cost / pos_qty
+                realized[row] = close * (tp - avg)
+                pos_cost -= avg * close
+                pos_qty -= close
+                q -= close
+            # ---- 剩余是开空 ----
+            if q > 0:
+                pos_cost -= tp * q
+                pos_qty -= q
+        else:
+            # ---- 先平空 ----
+            if pos_qty < 0:
+                cover = min(q, -pos_qty)
+                avg = pos_cost / pos_qty
+                realized[row] = cover * (avg - tp)
+                pos_cost += avg * cover
+                pos_qty += cover
+                q -= cover
+            # ---- 剩余是开多 ----
+            if q > 0:
+                pos_cost += tp * q
+                pos_qty += q
+    return pos_qty, pos_cost
+
+
+def make_engine(method="average"):
+    """按成本计算方法创建引擎：average 移动平均，fifo 先进先出"""
+    from .lots import FifoEngine
+    engines = {
+        "average": CostBasisEngine,
+        "fifo": FifoEngine,
+    }
+    if method not in engines:
+        raise ValueError(f"不支持的成本计算方法: {method}")
+    return engines[method]()
+
+
+def compute_pool(trades, method="average"):
+    """一次性计算整张成交表，返回 {symbol: Stock}"""
+    engine = make_engine(method)
+    engine.feed(trades)
+    return engine.to_pool()
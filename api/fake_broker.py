@@ -0,0 +1,340 @@
+"""
+本地券商替身：在没有网络、没有真实账户的机器上压测下载流程
+
+用缓存目录里的 CSV（真实下载的缓存，或 benchmarks.generate 生成的合成数据）作为数据源，
+模拟长桥 TradeContext 和富途 OpenD 交易接口，并复现它们的限频行为和网络延迟：
+
+- 长桥 order_detail 超过配额时抛出错误码 429002 的 OpenApiException
+- 富途 history_deal_list_query / order_fee_query / get_acc_cash_flow 超过每 30 秒的次数时返回 RET_ERROR
+
+设置环境变量 STOCK_TAX_FAKE_BROKER=<数据目录> 后，user_longport.get_ctx 和
+user_futu 创建交易上下文时会自动换成替身，下载代码本身不需要改动
+"""
+import os
+import random
+import sys
+import threading
+import time
+import types
+from collections import deque
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from . import utils
+
+ENV_VAR = "STOCK_TAX_FAKE_BROKER"
+LATENCY_ENV_VAR = "STOCK_TAX_FAKE_LATENCY"
+
+# 与真实接口一致的限频：(次数, 窗口秒数, 是否按账户分别计算)
+QUOTAS = {
+    "futu.history_deal": (10, 30, True),
+    "futu.fee_query": (10, 30, False),
+    "futu.cash_flow": (20, 30, False),
+    "longport.order_detail": (30, 30, False),
+}
+
+FILES = {
+    "futu_trade": "futu_trade.csv",
+    "futu_cash": "futu_cash.csv",
+    "longport_trade": "longbridge_trade.csv",
+    "longport_cash": "longbridge_cash.csv",
+}
+
+RET_OK, RET_ERROR = 0, -1
+ORDER_DETAIL_ERROR_LIMIT = 429002
+
+
+class _Quota:
+    """滑动窗口计数：窗口内次数已满时拒绝，而不是等待"""
+
+    def __init__(self, max_requests, window):
+        self.max_requests = max_requests
+        self.window = window
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= self.window:
+                self.calls.popleft()
+            if len(self.calls) >= self.max_requests:
+                self.rejected += 1
+                return False
+            self.calls.append(now)
+            return True
+
+
+class FakeBroker:
+    """
+    data_dir 下按 FILES 的文件名读取数据，缺少的文件视为没有记录
+    latency 为每次调用的平均延迟（秒），jitter 为上下浮动比例；
+    time_scale 同时缩放替身的限频窗口和 utils.RATE_LIMITS，用于快速压测
+    """
+
+    def __init__(self, data_dir, latency=0.05, jitter=0.5, time_scale=1.0, seed=0):
+        self.data_dir = Path(data_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.quotas = {}
+        self.quota_lock = threading.Lock()
+        self.calls = {}
+        self._load()
+
+    # ---------- 数据 ----------
+
+    def _read(self, kind, time_column, **kwargs):
+        path = self.data_dir / FILES[kind]
+        if not path.exists():
+            return pd.DataFrame(columns=[time_column])
+        df = utils.safe_read_csv(path, **kwargs)
+        df["_ts"] = pd.to_datetime(df[time_column], format="ISO8601", errors="coerce")
+        return df.dropna(subset=["_ts"]).sort_values("_ts", kind="stable").reset_index(drop=True)
+
+    def _load(self):
+        deals = self._read("futu_trade", "create_time", dtype={"deal_id": str, "order_id": str})
+        self.futu_fees = deals.groupby("order_id")["fee_amount"].sum() if "fee_amount" in deals else \
+            pd.Series(dtype=float)
+        deals = deals.drop(columns=["fee_amount"], errors="ignore")
+        self.futu_deals = {acc_id: part.reset_index(drop=True)
+                           for acc_id, part in deals.groupby("acc_id")} if len(deals) else {}
+
+        cash = self._read("futu_cash", "clearing_date")
+        if len(cash):
+            cash["_day"] = cash["_ts"].dt.strftime("%Y-%m-%d")
+        self.futu_cash = {key: part.drop(columns=["_ts", "_day"]).reset_index(drop=True)
+                          for key, part in cash.groupby(["acc_id", "_day"])} if len(cash) else {}
+        self.futu_accounts = sorted({int(a) for a in self.futu_deals} |
+                                    {int(a) for a, _ in self.futu_cash})
+
+        orders = self._read("longport_trade", "updated_at", dtype={"order_id": str})
+        self.longport_orders = orders
+        self.longport_index = {oid: i for i, oid in enumerate(orders["order_id"])} if len(orders) else {}
+        self.longport_cash = self._read("longport_cash", "business_time")
+
+    # ---------- 限频和延迟 ----------
+
+    def call(self, api, key=None):
+        """记一次调用并模拟延迟，超过配额时返回 False"""
+        with self.quota_lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+        with self.random_lock:
+            delay = self.latency * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if api not in QUOTAS:
+            return True
+        max_requests, window, per_key = QUOTAS[api]
+        quota_key = (api, key if per_key else None)
+        with self.quota_lock:
+            quota = self.quotas.get(quota_key)
+            if quota is None:
+                quota = self.quotas[quota_key] = _Quota(max_requests, window * self.time_scale)
+        return quota.allow()
+
+    def rejected(self):
+        """每个接口被限频拒绝的次数"""
+        out = {}
+        for (api, _), quota in self.quotas.items():
+            out[api] = out.get(api, 0) + quota.rejected
+        return out
+
+    def scale_client_limits(self):
+        """按 time_scale 缩放客户端的限流配置，让压测不必真的等待 30 秒"""
+        if self.time_scale == 1.0:
+            return
+        for name, (max_requests, window) in list(utils.RATE_LIMITS.items()):
+            utils.RATE_LIMITS[name] = (max_requests, window * self.time_scale)
+        with utils._rate_limiters_lock:
+            utils._rate_limiters.clear()
+
+
+# ---------- 富途替身 ----------
+
+class _FutuEnum:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+FutuTrdEnv = _FutuEnum(REAL="REAL", SIMULATE="SIMULATE")
+FutuTrdMarket = _FutuEnum(NONE="N/A", HK="HK", US="US")
+FutuCashFlowDirection = _FutuEnum(NONE="N/A", IN="IN", OUT="OUT")
+FutuSecurityFirm = _FutuEnum(FUTUSECURITIES="FUTUSECURITIES", FUTUINC="FUTUINC")
+
+_FREQUENCY_ERROR = "请求频率太高，请稍后再试"
+
+
+class FakeSecTradeContext:
+    """富途 OpenSecTradeContext 的替身"""
+
+    def __init__(self, broker, **kwargs):
+        self.broker = broker
+
+    def get_acc_list(self):
+        self.broker.call("futu.acc_list")
+        accounts = self.broker.futu_accounts
+        return RET_OK, pd.DataFrame({
+            "acc_id": accounts + [1],
+            "trd_env": [FutuTrdEnv.REAL] * len(accounts) + [FutuTrdEnv.SIMULATE],
+        })
+
+    def history_deal_list_query(self, acc_id, deal_market=None, start="", end="", **kwargs):
+        if not self.broker.call("futu.history_deal", acc_id):
+            return RET_ERROR, _FREQUENCY_ERROR
+        deals = self.broker.futu_deals.get(acc_id)
+        if deals is None or deals.empty:
+            return RET_OK, pd.DataFrame()
+        ts = deals["_ts"].to_numpy()
+        lo = np.searchsorted(ts, np.datetime64(pd.Timestamp(start)), side="left")
+        hi = np.searchsorted(ts, np.datetime64(pd.Timestamp(end)), side="right")
+        return RET_OK, deals.iloc[lo:hi].drop(columns=["_ts"]).reset_index(drop=True)
+
+    def order_fee_query(self, order_id_list, acc_id=None, trd_env=None, **kwargs):
+        if not self.broker.call("futu.fee_query"):
+            return RET_ERROR, _FREQUENCY_ERROR
+        fees = self.broker.futu_fees.reindex([str(o) for o in order_id_list]).fillna(0.0)
+        return RET_OK, pd.DataFrame({"order_id": list(order_id_list), "fee_amount": fees.to_numpy()})
+
+    def get_acc_cash_flow(self, clearing_date, trd_env=None, acc_id=None, cashflow_direction=None):
+        if not self.broker.call("futu.cash_flow"):
+            return RET_ERROR, _FREQUENCY_ERROR
+        rows = self.broker.futu_cash.get((acc_id, clearing_date))
+        return RET_OK, rows.copy() if rows is not None else pd.DataFrame()
+
+    def close(self):
+        pass
+
+
+def _futu_module(broker):
+    module = types.ModuleType("futu")
+    module.RET_OK = RET_OK
+    module.RET_ERROR = RET_ERROR
+    module.TrdEnv = FutuTrdEnv
+    module.TrdMarket = FutuTrdMarket
+    module.CashFlowDirection = FutuCashFlowDirection
+    module.SecurityFirm = FutuSecurityFirm
+    module.OpenSecTradeContext = lambda **kwargs: FakeSecTradeContext(broker, **kwargs)
+    return module
+
+
+# ---------- 长桥替身 ----------
+
+class OpenApiException(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"OpenApiException: (code={code}) {message}")
+        self.code = code
+        self.message = message
+
+
+class OrderChargeDetail:
+    def __init__(self, currency, total_amount):
+        self.currency = currency
+        self.total_amount = total_amount
+
+
+class _Record:
+    """只有数据属性的对象，get_public_attributes 能原样取出所有字段"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeTradeContext:
+    """长桥 TradeContext 的替身"""
+
+    def __init__(self, broker, config=None):
+        self.broker = broker
+
+    def history_orders(self, status=None, start_at=None, end_at=None, **kwargs):
+        self.broker.call("longport.history_orders")
+        orders = self.broker.longport_orders
+        if orders.empty:
+            return []
+        mask = np.ones(len(orders), dtype=bool)
+        if start_at is not None:
+            mask &= (orders["_ts"] >= pd.Timestamp(start_at)).to_numpy()
+        if end_at is not None:
+            mask &= (orders["_ts"] <= pd.Timestamp(end_at)).to_numpy()
+        picked = orders.loc[mask, ["order_id", "_ts"]]
+        return [_Record(order_id=oid, updated_at=ts.to_pydatetime(), status="Filled")
+                for oid, ts in zip(picked["order_id"], picked["_ts"])]
+
+    def order_detail(self, order_id):
+        if not self.broker.call("longport.order_detail"):
+            raise OpenApiException(ORDER_DETAIL_ERROR_LIMIT, "请求频率超限")
+        i = self.broker.longport_index.get(str(order_id))
+        if i is None:
+            raise OpenApiException(603001, f"order not found: {order_id}")
+        row = self.broker.longport_orders.iloc[i]
+        fields = {k: v for k, v in row.items()
+                  if not k.startswith("charge_detail_") and k != "_ts"}
+        fields["charge_detail"] = OrderChargeDetail(row.get("charge_detail_currency"),
+                                                    row.get("charge_detail_total_amount"))
+        return _Record(**fields)
+
+    def cash_flow(self, start_at=None, end_at=None, **kwargs):
+        self.broker.call("longport.cash_flow")
+        cash = self.broker.longport_cash
+        if cash.empty:
+            return []
+        mask = np.ones(len(cash), dtype=bool)
+        if start_at is not None:
+            mask &= (cash["_ts"] >= pd.Timestamp(start_at)).to_numpy()
+        if end_at is not None:
+            mask &= (cash["_ts"] <= pd.Timestamp(end_at)).to_numpy()
+        return [_Record(**{k: v for k, v in row.items() if k != "_ts"})
+                for row in cash.loc[mask].to_dict("records")]
+
+
+def _longport_modules(broker):
+    package = types.ModuleType("longport")
+    openapi = types.ModuleType("longport.openapi")
+    openapi.Config = types.SimpleNamespace(from_env=lambda: None)
+    openapi.TradeContext = lambda config=None: FakeTradeContext(broker, config)
+    openapi.OrderStatus = types.SimpleNamespace(Filled="Filled")
+    openapi.OrderChargeDetail = OrderChargeDetail
+    openapi.OpenApiException = OpenApiException
+    package.openapi = openapi
+    return package, openapi
+
+
+# ---------- 注入 ----------
+
+_installed = None
+_install_lock = threading.Lock()
+
+
+def _install_locked(broker):
+    """调用方持有 _install_lock"""
+    global _installed
+    broker.scale_client_limits()
+    sys.modules["futu"] = _futu_module(broker)
+    sys.modules["longport"], sys.modules["longport.openapi"] = _longport_modules(broker)
+    _installed = broker
+    return broker
+
+
+def install(broker):
+    """
+    用替身替换 futu 和 longport.openapi 模块，之后下载代码里的 SDK 导入都会拿到替身
+    返回 broker，便于读取调用次数和被拒绝次数
+    """
+    with _install_lock:
+        return _install_locked(broker)
+
+
+def install_from_env():
+    """STOCK_TAX_FAKE_BROKER 指向数据目录时安装替身（只安装一次），返回当前的替身或 None"""
+    data_dir = os.environ.get(ENV_VAR)
+    if not data_dir:
+        return _installed
+    # 检查和安装在同一次加锁内完成，并发调用只会创建一个替身
+    with _install_lock:
+        if _installed is not None:
+            return _installed
+        latency = float(os.environ.get(LATENCY_ENV_VAR, "0.05"))
+        return _install_locked(FakeBroker(data_dir, latency=latency))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from .result_cache import cached_call
+from .utils import safe_read_csv
+
+# 申报使用的本位币
+DEFAULT_BASE = "CNY"
+
+# 汇率文件格式：date,currency,rate，rate 为 1 单位外币折合多少本位币，例如
+# 2024-01-02,USD,7.0920
+RATE_COLUMNS = ["date", "currency", "rate"]
+
+
+def parse_rates(path):
+    """读取汇率文件，返回按 (currency, date) 排好序的表"""
+    rates = safe_read_csv(path, usecols=RATE_COLUMNS, dtype={"currency": str, "rate": "float64"})
+    rates["date"] = pd.to_datetime(rates["date"], errors="coerce")
+    rates["currency"] = rates["currency"].str.strip().str.upper()
+    rates = rates.dropna(subset=RATE_COLUMNS)
+    return rates.sort_values(["currency", "date"], kind="stable").reset_index(drop=True)
+
+
+def load_rates(path):
+    """
+    带缓存的汇率表：文件不变时直接复用上次解析的结果（进程内 LRU + 磁盘），
+    多次计算和多次启动都不会重复解析
+    """
+    return cached_call(parse_rates, path)
+
+
+def convert(events, rates, base=DEFAULT_BASE):
+    """
+    给事件表加上 rate 和 base_amount 两列
+    每个事件用其时间当天或之前最近一次的汇率（按币种 as-of 连接），本位币的汇率为 1；
+    找不到汇率的事件 base_amount 为 NaN
+    """
+    events = events.reset_index(drop=True)
+    left = pd.DataFrame({
+        "_row": np.arange(len(events)),
+        "time": pd.to_datetime(events["time"]).astype("datetime64[ns]"),
+        "currency": events["currency"].astype(object).str.upper(),
+    })
+    left = left[left["time"].notna() & left["currency"].notna()].sort_values("time", kind="stable")
+    right = rates.rename(columns={"date": "time"})[["time", "currency", "rate"]] \
+        .astype({"time": "datetime64[ns]"}).sort_values("time", kind="stable")
+
+    merged = pd.merge_asof(left, right, on="time", by="currency", direction="backward")
+    rate = np.full(len(events), np.nan)
+    rate[merged["_row"].to_numpy()] = merged["rate"].to_numpy()
+    is_base = (events["currency"].astype(object).str.upper() == base).to_numpy(dtype=bool)
+    rate[is_base] = 1.0
+
+    missing = np.isnan(rate) & (events["amount"].to_numpy(dtype=float) != 0)
+    if missing.any():
+        print(f"以下币种有 {int(missing.sum())} 条记录找不到汇率，未计入折算: "
+              f"{sorted(events.loc[missing, 'currency'].dropna().unique())}")
+    return events.assign(rate=rate, base_amount=events["amount"].to_numpy(dtype=float) * rate)
+
+
+def yearly_totals(events, rates, base=DEFAULT_BASE):
+    """
+    每年各币种原币合计和折算后的本位币合计
+    行是年份，列为各币种原币合计、各币种折合本位币、以及 "{base} Total"
+    """
+    converted = convert(events, rates, base)
+    native = converted.pivot_table(index="year", columns="currency", values="amount",
+                                   aggfunc="sum", fill_value=0.0)
+    in_base = converted.pivot_table(index="year", columns="currency", values="base_amount",
+                                    aggfunc="sum", fill_value=0.0)
+    in_base.columns = [f"{c}→{base}" for c in in_base.columns]
+    table = pd.concat([native, in_base], axis=1)
+    table[f"{base} Total"] = in_base.sum(axis=1)
+    table.index.name = "Year"
+    table.columns.name = None
+    return table
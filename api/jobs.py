@@ -0,0 +1,277 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from .utils import LogSink, capture_output
+
+# 任务状态：interrupted 表示进程在任务运行中退出，可以继续
+PENDING, RUNNING, DONE, FAILED, CANCELLED, INTERRUPTED = (
+    "pending", "running", "done", "failed", "cancelled", "interrupted")
+ACTIVE_STATES = (PENDING, RUNNING)
+RESUMABLE_STATES = (FAILED, CANCELLED, INTERRUPTED)
+
+# 进度写入任务表的最小间隔（秒），步骤切换和结束时总是立即写入
+PROGRESS_INTERVAL = 0.5
+
+_COLUMNS = ["id", "kind", "params", "state", "step", "done", "total", "checkpoint",
+            "message", "created_at", "updated_at"]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """SQLite 任务表，记录每个下载任务的状态、进度和断点"""
+
+    def __init__(self, path=".cache_data/jobs.sqlite"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, params TEXT, state TEXT, step TEXT, "
+                "done INTEGER, total INTEGER, checkpoint TEXT, message TEXT, "
+                "created_at TEXT, updated_at TEXT)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, kind, params):
+        job_id = uuid.uuid4().hex[:12]
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), PENDING, None, 0, 0,
+                 json.dumps({}), "", now, now))
+        return job_id
+
+    def update(self, job_id, **fields):
+        if "checkpoint" in fields:
+            fields["checkpoint"] = json.dumps(fields["checkpoint"])
+        fields["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _row(self, row):
+        job = dict(zip(_COLUMNS, row))
+        job["params"] = json.loads(job["params"])
+        job["checkpoint"] = json.loads(job["checkpoint"] or "{}")
+        return job
+
+    def get(self, job_id):
+        with self.lock, self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, limit=20):
+        with self.lock, self._connect() as conn:
+            rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs "
+                                "ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def mark_interrupted(self):
+        """进程重启后，上次没有结束的任务都视为中断"""
+        with self.lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET state = ? WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))})",
+                         (INTERRUPTED, *ACTIVE_STATES))
+
+
+class JobContext:
+    """
+    传给下载函数的任务上下文
+    cancel 为 threading.Event，可直接传给各 fetcher 的 cancel 参数；
+    reporter(step) 返回符合 fetcher progress(done, total, checkpoint) 约定的回调
+    """
+
+    def __init__(self, store, job_id, checkpoint):
+        self.store = store
+        self.job_id = job_id
+        self.checkpoint = checkpoint
+        self.cancel = threading.Event()
+        self.last_write = 0.0
+
+    def finished(self, step):
+        return step in self.checkpoint.get("steps_done", [])
+
+    def start(self, step):
+        self.check()
+        self.store.update(self.job_id, step=step, done=0, total=0, message="")
+
+    def finish(self, step):
+        """步骤完成后记录断点；被取消时中途退出的步骤不算完成"""
+        self.check()
+        self.checkpoint.setdefault("steps_done", []).append(step)
+        self.checkpoint.pop(step, None)
+        self.store.update(self.job_id, checkpoint=self.checkpoint)
+
+    def check(self):
+        if self.cancel.is_set():
+            raise JobCancelled()
+
+    def reporter(self, step):
+        def progress(done, total, checkpoint=None):
+            if checkpoint is not None:
+                self.checkpoint[step] = str(checkpoint)
+            now = time.monotonic()
+            if now - self.last_write < PROGRESS_INTERVAL and done < total:
+                return
+            self.last_write = now
+            message = f"最近完成: {checkpoint}" if checkpoint is not None else ""
+            self.store.update(self.job_id, done=done, total=total,
+                              checkpoint=self.checkpoint, message=message)
+        return progress
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def download_longport(job, params):
+    """长桥：成交明细（按时间顺序增量同步，天然可续传）→ 现金流水"""
+    from . import user_longport
+
+    ctx = user_longport.get_ctx()
+    start, end = _parse_time(params["start"]), _parse_time(params["end"])
+    if not job.finished("trade"):
+        job.start("trade")
+        user_longport.get_trade_flow(params["trade_file"], ctx, start, end,
+                                     progress=job.reporter("trade"), cancel=job.cancel)
+        job.finish("trade")
+    if not job.finished("cash"):
+        job.start("cash")
+        user_longport.get_cash_flow(params["cash_file"], ctx, start, end)
+        job.finish("cash")
+
+
+def download_futu(job, params):
+    """
+    富途：历史成交按窗口下载，续传时从所有账户都完成的最后一个窗口开始；
+    现金流水按天下载，已查询的日期记录在缓存旁边，续传时自动跳过
+    """
+    from . import user_futu
+
+    start, end = _parse_time(params["start"]), _parse_time(params["end"])
+    if not job.finished("trade"):
+        trade_start = _parse_time(job.checkpoint.get("trade", start))
+        job.start("trade")
+        user_futu.get_trade_flow(params["trade_file"], trade_start, end,
+                                 progress=job.reporter("trade"), cancel=job.cancel,
+                                 replace=trade_start == start and params.get("replace", False))
+        job.finish("trade")
+    if not job.finished("cash"):
+        job.start("cash")
+        user_futu.get_cash_flow(params["cash_file"], start, end,
+                                holiday_file=params.get("holiday_file"),
+                                progress=job.reporter("cash"), cancel=job.cancel)
+        job.finish("cash")
+
+
+JOB_KINDS = {
+    "longport": download_longport,
+    "futu": download_futu,
+}
+
+
+class JobRunner:
+    """
+    后台下载任务：工作线程执行，任务表持久化状态和断点
+    不同券商的任务可以同时运行，同一券商同时只运行一个；
+    每个任务的输出写到自己的 LogSink（logs/job-{id}.log），页面用 log_tail 显示最近几行
+    """
+
+    def __init__(self, db_path=".cache_data/jobs.sqlite", max_workers=2, max_logs=20):
+        self.store = JobStore(db_path)
+        self.store.mark_interrupted()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.contexts = {}
+        self.logs = {}      # {job_id: LogSink}，只保留最近 max_logs 个任务
+        self.max_logs = max_logs
+        self.log_dir = Path(db_path).parent / "logs"
+        self.lock = threading.Lock()
+
+    def _active(self, kind):
+        for job in self.store.list(limit=50):
+            if job["kind"] == kind and job["state"] in ACTIVE_STATES:
+                return job["id"]
+        return None
+
+    def submit(self, kind, params):
+        """提交任务，返回任务 id；同一券商已有任务在运行时返回那个任务的 id"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        with self.lock:
+            active = self._active(kind)
+            if active is not None:
+                return active
+            job_id = self.store.create(kind, params)
+            self._start(job_id, kind, params, {})
+        return job_id
+
+    def resume(self, job_id):
+        """从断点继续一个失败、取消或中断的任务"""
+        job = self.store.get(job_id)
+        if job is None or job["state"] not in RESUMABLE_STATES:
+            return False
+        with self.lock:
+            if self._active(job["kind"]) is not None:
+                return False
+            self.store.update(job_id, state=PENDING, message="")
+            self._start(job_id, job["kind"], job["params"], job["checkpoint"])
+        return True
+
+    def cancel(self, job_id):
+        context = self.contexts.get(job_id)
+        if context is not None:
+            context.cancel.set()
+            self.store.update(job_id, message="正在取消…")
+
+    def list(self, limit=20):
+        return self.store.list(limit)
+
+    def log_tail(self, job_id, n=20):
+        """任务最近 n 行输出，本进程没有运行过该任务时返回空字符串"""
+        sink = self.logs.get(job_id)
+        return sink.tail(n) if sink is not None else ""
+
+    def _start(self, job_id, kind, params, checkpoint):
+        context = JobContext(self.store, job_id, checkpoint)
+        self.contexts[job_id] = context
+        # 续传时接着写同一个日志文件，页面上的缓冲区重新开始
+        previous = self.logs.pop(job_id, None)
+        if previous is not None:
+            previous.close()
+        self.logs[job_id] = LogSink(log_file=self.log_dir / f"job-{job_id}.log")
+        while len(self.logs) > self.max_logs:
+            del self.logs[next(iter(self.logs))]
+        self.pool.submit(self._run, context, kind, params, self.logs[job_id])
+
+    def _run(self, context, kind, params, sink):
+        job_id = context.job_id
+        self.store.update(job_id, state=RUNNING)
+        try:
+            with capture_output(sink):
+                try:
+                    JOB_KINDS[kind](context, params)
+                    context.check()
+                    self.store.update(job_id, state=DONE, message="完成")
+                except JobCancelled:
+                    self.store.update(job_id, state=CANCELLED, checkpoint=context.checkpoint,
+                                      message="已取消，可从断点继续")
+                except BaseException as e:
+                    # SystemExit / KeyboardInterrupt 也要结束任务，否则任务会一直停在 running
+                    traceback.print_exc(file=sink)
+                    self.store.update(job_id, state=FAILED, checkpoint=context.checkpoint,
+                                      message=f"{type(e).__name__}: {e}")
+        finally:
+            self.contexts.pop(job_id, None)
+            sink.close()
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+from .trade_type import Stock
+
+EVENT_COLUMNS = ["symbol", "currency", "time", "year", "amount"]
+# 待合并的事件行数超过该值（且超过已合并行数）时按 (symbol, 日期) 合并一次
+COMPACT_ROWS = 65_536
+
+
+def _naive_times(times):
+    """转换成不带时区的 datetime64[ns]，带时区的时间保留当地时间"""
+    times = pd.DatetimeIndex(pd.to_datetime(times))
+    if times.tz is not None:
+        times = times.tz_localize(None)
+    return times.to_numpy(dtype="datetime64[ns]")
+
+
+class Pool(dict):
+    """
+    {symbol: Stock}，同时带上长表形式的已实现收益事件
+    events 列为 symbol, currency, time, year, amount
+    """
+
+    def __init__(self, stocks=(), events=None):
+        super().__init__(stocks)
+        self.events = events if events is not None else pd.DataFrame(columns=EVENT_COLUMNS)
+
+
+class PositionLedger:
+    """
+    按 symbol 编号的紧凑持仓账本（struct-of-arrays）
+
+    qty / cost / bonus 是以 symbol 编号为下标的 NumPy 数组，
+    年度已实现收益按年份各存一列，年份在入账前就已经是 int，不再逐条解析时间；
+    入账的 (sid, 日期, 金额) 另外按批追加到 events，用于换汇和明细展示。
+    汇率按日取值，events 按 (sid, 年份, 日期) 定期合并，占用的内存与持有过的
+    symbol × 交易日数成正比，不随成交笔数增长
+    """
+
+    __slots__ = ("symbols", "currencies", "index", "qty", "cost", "bonus",
+                 "by_year", "hits", "size", "events", "pending")
+
+    def __init__(self, capacity=64):
+        self.symbols = []
+        self.currencies = []
+        self.index = {}
+        self.qty = np.zeros(capacity)
+        self.cost = np.zeros(capacity)
+        self.bonus = np.zeros(capacity)
+        self.by_year = {}   # {year: ndarray}
+        self.hits = {}      # {year: ndarray}，记录该年是否有过非零收益事件
+        self.size = 0
+        self.events = []    # [(sids, years, 日期 datetime64[ns], amounts)]，第一批为已合并的部分
+        self.pending = 0    # 上次合并之后追加的事件行数
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        capacity = len(self.qty)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("qty", "cost", "bonus"):
+            arr = getattr(self, name)
+            new = np.zeros(capacity)
+            new[:len(arr)] = arr
+            setattr(self, name, new)
+        for table in (self.by_year, self.hits):
+            for year, arr in table.items():
+                new = np.zeros(capacity, dtype=arr.dtype)
+                new[:len(arr)] = arr
+                table[year] = new
+
+    def sid(self, symbol, currency=None):
+        """返回 symbol 的编号，不存在时新建"""
+        sid = self.index.get(symbol)
+        if sid is None:
+            sid = self.size
+            self._grow(sid + 1)
+            self.index[symbol] = sid
+            self.symbols.append(symbol)
+            self.currencies.append(currency)
+            self.size += 1
+        return sid
+
+    def sids(self, symbols, currencies):
+        """批量取编号，symbols 为去重后的序列"""
+        return np.fromiter((self.sid(s, c) for s, c in zip(symbols, currencies)),
+                           dtype=np.int64, count=len(symbols))
+
+    def add_realized(self, sids, years, amounts, times=None):
+        """
+        批量记录已实现收益事件，零值事件被忽略（与 Stock._add_bonus 一致）
+        times 为每个事件的时间，为空时记为当年的最后一天
+        """
+        sids = np.asarray(sids, dtype=np.int64)
+        years = np.asarray(years, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=float)
+        hit = amounts != 0
+        if not hit.any():
+            return
+        sids, years, amounts = sids[hit], years[hit], amounts[hit]
+        if times is None:
+            times = pd.to_datetime(years.astype(str) + "-12-31").to_numpy()
+        else:
+            times = _naive_times(times)[hit].astype("datetime64[D]").astype("datetime64[ns]")
+        self.events.append((sids, years, times, amounts))
+        self.pending += len(sids)
+        if self.pending > max(COMPACT_ROWS, len(self.events[0][0])):
+            self.compact()
+        np.add.at(self.bonus, sids, amounts)
+        capacity = len(self.qty)
+        for year in np.unique(years):
+            year = int(year)
+            mask = years == year
+            if year not in self.by_year:
+                self.by_year[year] = np.zeros(capacity)
+                self.hits[year] = np.zeros(capacity, dtype=bool)
+            np.add.at(self.by_year[year], sids[mask], amounts[mask])
+            self.hits[year][sids[mask]] = True
+
+    def add_fees(self, symbols, currencies, fees, years, times=None):
+        """批量记录费用（视作负收益），fee <= 0 的记录被忽略（与 Stock.add_fee 一致）"""
+        fees = np.asarray(fees, dtype=float)
+        keep = fees > 0
+        if not keep.any():
+            return
+        symbols = np.asarray(symbols, dtype=object)[keep]
+        currencies = np.asarray(currencies, dtype=object)[keep]
+        uniq, first, inverse = np.unique(symbols, return_index=True, return_inverse=True)
+        usids = self.sids(uniq, currencies[first])
+        if times is not None:
+            times = _naive_times(times)[keep]
+        self.add_realized(usids[inverse], np.asarray(years)[keep], -fees[keep], times)
+
+    def close_out(self, sid, year, time=None):
+        """按零价值平掉全部持仓（期权到期），返回计入的收益"""
+        if self.qty[sid] == 0:
+            return 0.0
+        realized = -float(self.cost[sid])
+        self.add_realized([sid], [year], [realized], None if time is None else [time])
+        self.qty[sid] = 0
+        self.cost[sid] = 0.0
+        return realized
+
+    def stock(self, sid):
+        s = Stock(self.symbols[sid], self.currencies[sid])
+        s.qty = self.qty[sid].item()
+        s.cost = self.cost[sid].item()
+        s.bonus = self.bonus[sid].item()
+        s.bonus_by_year = {
+            year: self.by_year[year][sid].item()
+            for year in sorted(self.by_year) if self.hits[year][sid]
+        }
+        return s
+
+    def compact(self):
+        """把全部事件按 (sid, 年份, 日期) 合并成一批，金额相加"""
+        if not self.events:
+            return
+        sids, years, times, amounts = (np.concatenate(parts) for parts in zip(*self.events))
+        days = times.view(np.int64)
+        order = np.lexsort((sids, days, years))
+        sids, years, days, amounts = sids[order], years[order], days[order], amounts[order]
+        start = np.ones(len(sids), dtype=bool)
+        start[1:] = (sids[1:] != sids[:-1]) | (days[1:] != days[:-1]) | (years[1:] != years[:-1])
+        groups = np.cumsum(start) - 1
+        self.events = [(sids[start], years[start], days[start].view("datetime64[ns]"),
+                        np.bincount(groups, weights=amounts, minlength=int(start.sum())))]
+        self.pending = 0
+
+    def event_table(self):
+        """已实现收益事件的长表，每个 symbol 每天一行，按年份、日期排列"""
+        if not self.events:
+            return pd.DataFrame(columns=EVENT_COLUMNS)
+        self.compact()
+        sids, years, times, amounts = self.events[0]
+        return pd.DataFrame({
+            "symbol": np.asarray(self.symbols, dtype=object)[sids],
+            "currency": np.asarray(self.currencies, dtype=object)[sids],
+            "time": times,
+            "year": years,
+            "amount": amounts,
+        })
+
+    def to_pool(self):
+        """转换成 {symbol: Stock}，供页面展示；events 为已实现收益事件表"""
+        return Pool(((self.symbols[sid], self.stock(sid)) for sid in range(self.size)),
+                    self.event_table())
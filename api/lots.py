@@ -0,0 +1,58 @@
+from collections import deque
+from .engine import CostBasisEngine
+
+
+class FifoEngine(CostBasisEngine):
+    """
+    先进先出（FIFO）批次引擎，与 CostBasisEngine 共用输入格式和 PositionLedger
+
+    每个 symbol 的未平仓批次保存在 deque 中，元素为 [数量, 含费单价]；
+    多头批次数量为正、空头批次数量为负，平仓总是从最早的批次开始扣减，
+    每笔成交的匹配是均摊 O(1) 的
+    """
+
+    def __init__(self, ledger=None):
+        super().__init__(ledger)
+        self.lots = {}   # sid -> deque([[qty, price], ...])
+
+    def replay(self, sid, sides, qtys, prices, realized, rows):
+        lots = self.lots.get(sid)
+        if lots is None:
+            lots = self.lots[sid] = deque()
+        pos_qty = float(self.ledger.qty[sid])
+        pos_cost = float(self.ledger.cost[sid])
+
+        for sell, q, tp, row in zip(sides, qtys, prices, rows):
+            sign = -1 if sell else 1
+            pnl = 0.0
+            # ---- 先按最早的批次平掉反向持仓 ----
+            while q > 0 and lots and lots[0][0] * sign < 0:
+                lot = lots[0]
+                matched = min(q, abs(lot[0]))
+                # 平多：卖价 - 成本；平空：成本 - 买价
+                pnl += matched * (lot[1] - tp) * sign
+                pos_cost += matched * lot[1] * sign
+                pos_qty += matched * sign
+                lot[0] += matched * sign
+                q -= matched
+                if lot[0] == 0:
+                    lots.popleft()
+            if pnl != 0:
+                realized[row] = pnl
+            # ---- 剩余部分开新批次 ----
+            if q > 0:
+                lots.append([q * sign, tp])
+                pos_cost += tp * q * sign
+                pos_qty += q * sign
+
+        self.ledger.qty[sid] = pos_qty
+        self.ledger.cost[sid] = pos_cost
+
+    def close_out(self, sid, year, time=None):
+        self.lots.pop(sid, None)
+        return super().close_out(sid, year, time)
+
+    def open_lots(self, symbol):
+        """返回某个 symbol 当前未平仓的批次 [(数量, 单价), ...]"""
+        sid = self.ledger.index.get(symbol)
+        return [tuple(lot) for lot in self.lots.get(sid, ())]
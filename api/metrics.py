@@ -0,0 +1,150 @@
+import atexit
+import contextlib
+import functools
+import json
+import threading
+import time
+from pathlib import Path
+
+# 默认的 JSON lines 输出文件，configure(None) 可关闭落盘
+DEFAULT_METRICS_FILE = ".cache_data/metrics.jsonl"
+
+# 记录先进入内存缓冲，攒够行数或超过间隔再批量写入，热路径上不做文件 I/O
+FLUSH_LINES = 256
+FLUSH_INTERVAL = 1.0
+# 按大小轮转：metrics.jsonl -> metrics.jsonl.1 -> ... -> metrics.jsonl.{BACKUP_COUNT}
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 3
+
+_lock = threading.Lock()
+_io_lock = threading.Lock()  # 先取 _io_lock 再取 _lock，保证记录按顺序写入
+_sink_path = DEFAULT_METRICS_FILE
+_spans = {}      # name -> [count, total, max]
+_counters = {}   # name -> int
+_pending = []
+_last_flush = 0.0
+_file = None
+_file_path = None
+
+
+def configure(path=DEFAULT_METRICS_FILE):
+    """设置 JSON lines 输出文件，None 表示只在内存中汇总"""
+    global _sink_path
+    flush()
+    with _io_lock, _lock:
+        _sink_path = path
+        _close_file()
+
+
+def reset():
+    """清空内存中的汇总（不影响已经写入文件的记录）"""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def _emit(record):
+    """在持有 _lock 时调用，只放入缓冲；返回是否需要写入文件"""
+    if _sink_path is None:
+        return False
+    _pending.append(record)
+    return len(_pending) >= FLUSH_LINES or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+
+
+def _close_file():
+    global _file, _file_path
+    if _file is not None:
+        _file.close()
+    _file, _file_path = None, None
+
+
+def _rotate(path):
+    for i in range(BACKUP_COUNT - 1, 0, -1):
+        src = path.with_name(f"{path.name}.{i}")
+        if src.exists():
+            src.replace(path.with_name(f"{path.name}.{i + 1}"))
+    if BACKUP_COUNT > 0:
+        path.replace(path.with_name(f"{path.name}.1"))
+    else:
+        path.unlink(missing_ok=True)
+
+
+def flush():
+    """把缓冲中的记录写入文件，文件超过 MAX_BYTES 时先轮转"""
+    global _file, _file_path, _last_flush
+    with _io_lock:
+        with _lock:
+            records, path = list(_pending), _sink_path
+            _pending.clear()
+            _last_flush = time.monotonic()
+        if not records or path is None:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records)
+        path = Path(path)
+        if _file is None or _file_path != path:
+            _close_file()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _file, _file_path = open(path, "a", encoding="utf-8"), path
+        if _file.tell() > 0 and _file.tell() + len(data.encode("utf-8")) > MAX_BYTES:
+            _close_file()
+            _rotate(path)
+            _file, _file_path = open(path, "a", encoding="utf-8"), path
+        _file.write(data)
+        _file.flush()
+
+
+atexit.register(flush)
+
+
+def record_span(name, duration, **fields):
+    """记录一段已经结束的耗时，例如限流器的等待时间"""
+    with _lock:
+        stat = _spans.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+        due = _emit({"type": "span", "name": name, "ts": time.time(),
+                     "duration": round(duration, 6), **fields})
+    if due:
+        flush()
+
+
+@contextlib.contextmanager
+def span(name, **fields):
+    """计时一个阶段：with span("csv.parse", path=...): ..."""
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record_span(name, time.perf_counter() - started, **fields)
+
+
+def timed(name):
+    """装饰器版本的 span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def incr(name, n=1):
+    """计数器：处理行数、API 调用次数、重试次数、429 次数等"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        due = _emit({"type": "counter", "name": name, "ts": time.time(), "value": n})
+    if due:
+        flush()
+
+
+def summary():
+    """返回 (spans, counters)，spans 为 [{name, count, total_s, max_s}]"""
+    with _lock:
+        spans = [
+            {"name": name, "count": c, "total_s": round(total, 4), "max_s": round(mx, 4)}
+            for name, (c, total, mx) in sorted(_spans.items())
+        ]
+        counters = dict(sorted(_counters.items()))
+    return spans, counters
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from .ledger import EVENT_COLUMNS
+
+
+def long_table(source):
+    """
+    统一成长表 (symbol, currency, year, amount)
+    source 可以是事件表、带 events 的计算结果（Pool），或者 Stock 列表 / {symbol: Stock}
+    """
+    if isinstance(source, pd.DataFrame):
+        return source
+    events = getattr(source, "events", None)
+    if events is not None:
+        return events
+    if isinstance(source, dict):
+        source = source.values()
+    records = [(s.symbol, s.currency, y, v) for s in source for y, v in s.bonus_by_year.items()]
+    return pd.DataFrame.from_records(records, columns=["symbol", "currency", "year", "amount"])
+
+
+def combine(*sources):
+    """合并多个券商的结果，返回一张事件长表"""
+    tables = [long_table(s) for s in sources]
+    tables = [t for t in tables if len(t)]
+    if not tables:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+
+def yearly_tables(source):
+    """
+    按币种汇总每个标的每年的已实现收益
+    返回 {currency: DataFrame}，行是 Symbol，列是年份和 Total，最后一行是币种合计
+    """
+    events = long_table(source)
+    tables = {}
+    for currency, part in events.groupby("currency", sort=False):
+        df = part.pivot_table(index="symbol", columns="year", values="amount",
+                              aggfunc="sum", fill_value=0.0, sort=True)
+        df.columns = [str(y) for y in df.columns]
+        df["Total"] = df.sum(axis=1)
+        total = df.sum().rename(f"{currency} Total").to_frame().T
+        tables[currency] = pd.concat([df, total]).rename_axis("Symbol")
+    return tables
+
+
+def split_total(df):
+    """把 yearly_tables 的结果拆成 (明细, 合计行)"""
+    return df.iloc[:-1], df.iloc[-1:]
+
+
+def page_table(df, query="", sort_by=None, ascending=False, page=1, page_size=50):
+    """
+    在服务端完成过滤、排序和分页，只把当前页交给前端渲染
+    query 按 Symbol 子串过滤（不区分大小写），返回 (当前页, 过滤后的总行数)
+    """
+    if query:
+        df = df[df.index.to_series().str.contains(query, case=False, regex=False).to_numpy()]
+    if sort_by is not None:
+        if sort_by == df.index.name:
+            df = df.sort_index(ascending=ascending, kind="stable")
+        else:
+            df = df.sort_values(sort_by, ascending=ascending, kind="stable")
+    total = len(df)
+    pages = max(1, int(np.ceil(total / page_size)))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], total
+
+
+def symbol_events(source, symbol):
+    """单个标的每天的已实现收益合计（账本按标的、按天汇总），按时间排序"""
+    events = long_table(source)
+    rows = events[events["symbol"] == symbol]
+    if "time" in rows.columns:
+        rows = rows.sort_values("time", kind="stable")
+    return rows.reset_index(drop=True)
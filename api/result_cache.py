@@ -0,0 +1,143 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from .engine import ENGINE_VERSION
+
+
+def file_fingerprint(path, hash_content=False):
+    """路径 + 大小 + 修改时间，hash_content=True 时再加上内容哈希"""
+    if path is None:
+        return None
+    path = Path(path)
+    if not path.exists():
+        return (str(path), None)
+    stat = path.stat()
+    fp = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if hash_content:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        fp += (h.hexdigest(),)
+    return fp
+
+
+def make_key(fn, paths, args=(), kwargs=None, hash_content=False):
+    parts = (
+        ENGINE_VERSION,
+        f"{fn.__module__}.{fn.__qualname__}",
+        tuple(file_fingerprint(p, hash_content) for p in paths),
+        repr(args),
+        repr(sorted((kwargs or {}).items())),
+    )
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    计算结果缓存：进程内 LRU + 磁盘 pickle
+    输入文件不变时直接返回上次的结果；按总大小和存活时间淘汰旧条目
+    """
+
+    def __init__(self, directory=".cache_data/results", max_bytes=256 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, memory_items=8):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _file(self, key):
+        return self.directory / f"{key}.pkl"
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return True, self.memory[key]
+        path = self._file(key)
+        if not path.exists() or time.time() - path.stat().st_mtime > self.max_age:
+            return False, None
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except Exception:
+            # 损坏或旧版本的条目直接丢弃
+            path.unlink(missing_ok=True)
+            return False, None
+        os.utime(path)  # 刷新访问时间，淘汰时按最近使用排序
+        self._remember(key, value)
+        return True, value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        tmp = self._file(key).with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._file(key))
+        self.evict()
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def evict(self):
+        """删除过期条目，再按最近使用时间从旧到新删除直到总大小达标"""
+        if not self.directory.exists():
+            return
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.pkl"):
+            stat = path.stat()
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if self.directory.exists():
+            for path in self.directory.glob("*.pkl"):
+                path.unlink(missing_ok=True)
+
+
+_default_cache = None
+
+
+def get_result_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+def cached_call(fn, *args, cache=None, hash_content=False, **kwargs):
+    """
+    以输入文件为键缓存 fn(*args, **kwargs) 的结果
+    位置参数中的字符串 / Path 视作输入文件参与指纹计算
+    """
+    cache = cache or get_result_cache()
+    paths = [a for a in args if isinstance(a, (str, Path))]
+    key = make_key(fn, paths, args, kwargs, hash_content)
+    hit, value = cache.get(key)
+    if hit:
+        return value
+    value = fn(*args, **kwargs)
+    cache.put(key, value)
+    return value
@@ -0,0 +1,344 @@
+"""
+带类型的本地缓存：每个 CSV 缓存旁边一个 SQLite 文件（{csv}.store.sqlite）
+
+- 每种数据一张表，schema 固定，时间列存为 int64 纳秒，读出来直接是 datetime64，不再逐行解析字符串
+- 下载代码通过 append_new / write_all 写入：先按 dedup 的键索引追加 CSV，再把同样的行按键 upsert 进表
+- 读取时可以只选部分列、只取时间范围，也可以按时间顺序分块读取（时间列有索引，不需要外部排序）
+- CSV 仍然是导入 / 导出格式：文件的大小或修改时间与表里记录的不一致时（例如手工编辑过），
+  下次读取前会从 CSV 重新导入一次
+"""
+import sqlite3
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from . import dedup, metrics
+from .utils import safe_read_csv
+
+# 每种数据的固定 schema，time_column 用于时间范围查询和按时间排序
+# CATEGORY 在表里按 TEXT 保存，读出时转成 category
+SCHEMAS = {
+    "futu_trade": {
+        "time_column": "create_time",
+        "columns": {
+            "deal_id": "TEXT",
+            "order_id": "TEXT",
+            "code": "CATEGORY",
+            "stock_name": "TEXT",
+            "deal_market": "CATEGORY",
+            "trd_side": "CATEGORY",
+            "qty": "REAL",
+            "price": "REAL",
+            "create_time": "TIMESTAMP",
+            "acc_id": "INTEGER",
+            "fee_amount": "REAL",
+        },
+    },
+    "futu_cash": {
+        "time_column": "clearing_date",
+        "columns": {
+            "cashflow_id": "TEXT",
+            "clearing_date": "TIMESTAMP",
+            "settlement_date": "TIMESTAMP",
+            "currency": "CATEGORY",
+            "cashflow_type": "CATEGORY",
+            "cashflow_direction": "CATEGORY",
+            "cashflow_amount": "REAL",
+            "cashflow_remark": "TEXT",
+            "acc_id": "INTEGER",
+        },
+    },
+    "longport_trade": {
+        "time_column": "updated_at",
+        "columns": {
+            "order_id": "TEXT",
+            "symbol": "CATEGORY",
+            "side": "CATEGORY",
+            "price": "REAL",
+            "quantity": "REAL",
+            "executed_price": "REAL",
+            "executed_quantity": "REAL",
+            "charge_detail_currency": "CATEGORY",
+            "charge_detail_total_amount": "REAL",
+            "submitted_at": "TIMESTAMP",
+            "updated_at": "TIMESTAMP",
+        },
+    },
+    "longport_cash": {
+        "time_column": "business_time",
+        "columns": {
+            "balance": "REAL",
+            "business_time": "TIMESTAMP",
+            "business_type": "TEXT",
+            "currency": "CATEGORY",
+            "description": "TEXT",
+            "direction": "CATEGORY",
+            "symbol": "TEXT",
+            "transaction_flow_name": "CATEGORY",
+        },
+    },
+}
+
+_SQL_TYPES = {"TEXT": "TEXT", "CATEGORY": "TEXT", "REAL": "REAL",
+              "INTEGER": "INTEGER", "TIMESTAMP": "INTEGER"}
+KEY_COLUMN = "_key"
+# 无法解析的时间存为最大值，按时间排序时排在最后（与 streaming 的排序键一致）
+NAT_VALUE = np.iinfo(np.int64).max
+IMPORT_CHUNK = 200_000
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _store_path(csv_path):
+    return f"{csv_path}.store.sqlite"
+
+
+def _fingerprint(path):
+    path = Path(path)
+    if not path.exists():
+        return ""
+    stat = path.stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _to_ns(values):
+    """时间字符串 -> int64 纳秒，带时区的时间保留当地时间"""
+    ts = pd.to_datetime(values, format="ISO8601", errors="coerce")
+    if getattr(ts.dt, "tz", None) is not None:
+        ts = ts.dt.tz_localize(None)
+    ns = ts.to_numpy(dtype="datetime64[ns]").view(np.int64).copy()
+    ns[ts.isna().to_numpy()] = NAT_VALUE
+    return ns
+
+
+def _from_ns(values):
+    """int64 纳秒 -> datetime64[ns]；按整数转换，不经过 float，避免丢失纳秒精度"""
+    if values.dtype == np.int64:
+        ns = values.to_numpy()
+        missing = ns == NAT_VALUE
+    else:
+        missing = values.isna().to_numpy()
+        ns = values.where(~missing, NAT_VALUE).to_numpy(dtype=np.int64)
+        missing |= ns == NAT_VALUE
+    out = ns.view("datetime64[ns]").copy()
+    out[missing] = np.datetime64("NaT")
+    return out
+
+
+class CacheStore:
+    """一个 CSV 缓存对应的带类型 SQLite 表"""
+
+    def __init__(self, csv_path, kind, sync=True):
+        self.csv_path = Path(csv_path)
+        self.kind = kind
+        self.schema = SCHEMAS[kind]
+        self.time_column = self.schema["time_column"]
+        key_columns = next(iter(dedup.INDEXES[kind].values()))
+        self.key_columns = key_columns
+        self.conn = sqlite3.connect(_store_path(csv_path), timeout=30)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            if not self._columns():
+                defs = [f"{_quote(c)} {_SQL_TYPES[t]}" for c, t in self.schema["columns"].items()]
+                defs.append(f"{_quote(KEY_COLUMN)} INTEGER")
+                self.conn.execute(f"CREATE TABLE rows ({', '.join(defs)})")
+                self.conn.execute(f"CREATE INDEX rows_time ON rows ({_quote(self.time_column)})")
+                self.conn.execute(f"CREATE INDEX rows_key ON rows ({_quote(KEY_COLUMN)})")
+        if sync and self._stored_fingerprint() != _fingerprint(self.csv_path):
+            self.import_csv()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _columns(self):
+        return [r[1] for r in self.conn.execute("PRAGMA table_info(rows)").fetchall()]
+
+    def _stored_fingerprint(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        return row[0] if row else None
+
+    def _save_fingerprint(self):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)",
+                          (_fingerprint(self.csv_path),))
+
+    def _typed(self, text):
+        """CSV 文本形式的表（dedup.as_text）-> 按 schema 转换好的列，schema 外的列保持文本"""
+        types = self.schema["columns"]
+        out = {}
+        for col in text.columns:
+            typ = types.get(col, "TEXT")
+            values = text[col]
+            if typ == "TIMESTAMP":
+                out[col] = _to_ns(values)
+            elif typ in ("REAL", "INTEGER"):
+                number = pd.to_numeric(values, errors="coerce")
+                if typ == "INTEGER":
+                    number = number.astype("Int64")
+                out[col] = number.astype(object).where(number.notna(), None).to_numpy()
+            else:
+                out[col] = values.where(values != "", None).to_numpy(dtype=object)
+        return pd.DataFrame(out)
+
+    def _insert(self, text, upsert=True):
+        """写入一批文本行；upsert=True 时先删除去重键相同的旧行"""
+        if len(text) == 0:
+            return
+        existing = self._columns()
+        for col in text.columns:
+            if col not in existing:
+                self.conn.execute(f"ALTER TABLE rows ADD COLUMN {_quote(col)} TEXT")
+        typed = self._typed(text)
+        if self.key_columns is not None and set(self.key_columns) <= set(text.columns):
+            keys = dedup.row_keys(text, self.key_columns).view(np.int64)
+            typed[KEY_COLUMN] = keys
+            values = np.unique(keys).tolist() if upsert else []
+            for i in range(0, len(values), 900):
+                batch = values[i:i + 900]
+                self.conn.execute(f"DELETE FROM rows WHERE {_quote(KEY_COLUMN)} "
+                                  f"IN ({', '.join('?' * len(batch))})", batch)
+        columns = ", ".join(_quote(c) for c in typed.columns)
+        marks = ", ".join("?" * len(typed.columns))
+        rows = zip(*(typed[c].tolist() for c in typed.columns))
+        self.conn.executemany(f"INSERT INTO rows ({columns}) VALUES ({marks})", rows)
+
+    def append(self, df):
+        """把已经追加到 CSV 的行按去重键 upsert 进表，并记录 CSV 的当前状态"""
+        with metrics.span("store.append", kind=self.kind, rows=len(df)), self.conn:
+            self._insert(dedup.as_text(df))
+            self._save_fingerprint()
+
+    def replace(self, df):
+        """CSV 被整体重写后，用同样的内容替换整张表"""
+        with metrics.span("store.replace", kind=self.kind, rows=len(df)), self.conn:
+            self.conn.execute("DELETE FROM rows")
+            self._insert(dedup.as_text(df))
+            self._save_fingerprint()
+
+    def import_csv(self):
+        """从（可能是手工编辑过的）CSV 分块导入，替换整张表"""
+        path = self.csv_path
+        with metrics.span("store.import", path=str(path)), self.conn:
+            self.conn.execute("DELETE FROM rows")
+            if path.exists() and path.stat().st_size > 0:
+                reader = safe_read_csv(path, dtype=str, keep_default_na=False,
+                                       chunksize=IMPORT_CHUNK)
+                with reader:
+                    for text in reader:
+                        # 原样镜像 CSV，文件里重复的行也保留，与直接读 CSV 的结果一致
+                        self._insert(text, upsert=False)
+            self._save_fingerprint()
+
+    def export_csv(self, csv_path, **kwargs):
+        """导出为 CSV，时间列按 ISO 格式写出，导出的文件可以再导入"""
+        df = self.read(**kwargs)
+        df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+        return len(df)
+
+    def _select(self, columns, start, end):
+        existing = self._columns()
+        if columns is None:
+            columns = [c for c in existing if c != KEY_COLUMN]
+        sql = ", ".join(f"{_quote(c)}" if c in existing else f"NULL AS {_quote(c)}"
+                        for c in columns)
+        sql = f"SELECT {sql} FROM rows"
+        where, params = [], []
+        if start is not None:
+            where.append(f"{_quote(self.time_column)} >= ?")
+            params.append(int(pd.Timestamp(start).value))
+        if end is not None:
+            where.append(f"{_quote(self.time_column)} < ?")
+            params.append(int(pd.Timestamp(end).value))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # rowid 保持同一时间内的写入顺序，与 CSV 中的先后一致
+        sql += f" ORDER BY {_quote(self.time_column)}, rowid"
+        return columns, sql, params
+
+    def _frame(self, columns, rows):
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=False)
+        for col in columns:
+            typ = self.schema["columns"].get(col)
+            if typ == "TIMESTAMP":
+                df[col] = _from_ns(df[col])
+            elif typ == "REAL":
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+            elif typ == "INTEGER":
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+            elif typ == "CATEGORY":
+                df[col] = df[col].astype("category")
+        return df
+
+    def read(self, columns=None, start=None, end=None):
+        """按时间顺序读取，columns 为要读取的列，start/end 按 time_column 过滤（左闭右开）"""
+        columns, sql, params = self._select(columns, start, end)
+        with metrics.span("store.read", kind=self.kind):
+            df = self._frame(columns, self.conn.execute(sql, params).fetchall())
+        metrics.incr("rows.store", len(df))
+        return df
+
+    def read_chunks(self, chunksize, columns=None, start=None, end=None):
+        """按时间顺序逐块读取，每块最多 chunksize 行"""
+        columns, sql, params = self._select(columns, start, end)
+        cursor = self.conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                return
+            metrics.incr("rows.store", len(rows))
+            yield self._frame(columns, rows)
+
+    def time_range(self):
+        """(最早, 最新) 的时间，表为空或没有有效时间时为 None"""
+        col = _quote(self.time_column)
+        low, high = self.conn.execute(
+            f"SELECT MIN({col}), MAX({col}) FROM rows WHERE {col} < ?", (NAT_VALUE,)).fetchone()
+        if low is None:
+            return None
+        return pd.Timestamp(low), pd.Timestamp(high)
+
+
+def read_table(path, schema, columns=None, use_store=True):
+    """
+    读取 path 对应的缓存，schema 为数据种类（SCHEMAS 的键），结果按时间升序
+    use_store=False 时直接解析 CSV（不建立 SQLite 文件），顺序与文件一致
+    """
+    if not use_store:
+        kwargs = {"usecols": lambda c: c in set(columns)} if columns is not None else {}
+        return safe_read_csv(path, schema=schema, **kwargs)
+    with CacheStore(path, schema) as store:
+        return store.read(columns)
+
+
+def read_chunks(path, schema, chunksize, columns=None):
+    """按时间顺序分块读取 path 对应的带类型缓存"""
+    with CacheStore(path, schema) as store:
+        yield from store.read_chunks(chunksize, columns)
+
+
+def time_range(path, schema):
+    with CacheStore(path, schema) as store:
+        return store.time_range()
+
+
+def append_new(path, df, kind, prepare=None):
+    """按键索引把新行追加到 CSV（dedup.append_new），再把实际追加的行写入带类型缓存"""
+    with CacheStore(path, kind) as store:
+        added = dedup.append_new(path, df, kind, prepare)
+        if added is not None and len(added):
+            store.append(added)
+    return added
+
+
+def write_all(path, df, kind):
+    """覆盖写入 CSV 和带类型缓存（全量下载时使用）"""
+    with CacheStore(path, kind, sync=False) as store:
+        df = dedup.write_all(path, df, kind)
+        store.replace(df)
+    return df
@@ -0,0 +1,134 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from .utils import safe_read_csv
+
+# 排序键列：时间转成 int64 纳秒，无法解析的时间排在最后
+SORT_KEY = "_ts"
+NAT_KEY = np.iinfo(np.int64).max
+# 一次归并的最大路数，落盘切片为 chunksize // FAN_IN 行
+FAN_IN = 64
+
+
+def _with_key(chunk, time_column):
+    ts = pd.to_datetime(chunk[time_column], format="ISO8601", errors="coerce")
+    key = ts.to_numpy(dtype="datetime64[ns]").view(np.int64).copy()
+    key[ts.isna().to_numpy()] = NAT_KEY
+    return chunk.assign(**{SORT_KEY: key})
+
+
+def read_chunks(path, time_column, chunksize=200_000, schema=None):
+    """按块读取 CSV，每块附带 int64 的排序键"""
+    reader = safe_read_csv(path, schema=schema, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            yield _with_key(chunk, time_column)
+
+
+def is_time_sorted(path, time_column, chunksize=200_000, schema=None):
+    """单遍扫描判断文件是否已按时间升序，只占用一个块的内存"""
+    last = None
+    for chunk in read_chunks(path, time_column, chunksize, schema):
+        key = chunk[SORT_KEY].to_numpy()
+        if len(key) == 0:
+            continue
+        if (last is not None and key[0] < last) or (np.diff(key) < 0).any():
+            return False
+        last = key[-1]
+    return True
+
+
+def _plain(chunk):
+    """category 列转回 object：每个切片都会带上整块的类别表，落盘和归并时会成倍放大"""
+    categorical = [c for c, t in chunk.dtypes.items() if isinstance(t, pd.CategoricalDtype)]
+    return chunk.astype({c: object for c in categorical}) if categorical else chunk
+
+
+def _write_run(frames, directory, block):
+    """把已排序的数据按 block 行切片依次 pickle 到同一个临时文件"""
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for frame in frames:
+            for start in range(0, len(frame), block):
+                pickle.dump(frame.iloc[start:start + block], f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path, rows):
+    """逐段读回一个 run，每段由若干个切片拼成，约 rows 行"""
+    parts, n = [], 0
+    with open(path, "rb") as f:
+        while True:
+            try:
+                part = pickle.load(f)
+            except EOFError:
+                break
+            parts.append(part)
+            n += len(part)
+            if n >= rows:
+                yield pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+                parts, n = [], 0
+    if parts:
+        yield pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+
+def _merge(readers):
+    """k 路归并，readers 按 run 编号排列，逐批产出已排序的数据"""
+    buffers = [next(r, None) for r in readers]
+    while True:
+        live = [i for i, b in enumerate(buffers) if b is not None]
+        if not live:
+            return
+        # 每个缓冲区最后一行的最小值之前的数据都可以安全输出
+        cutoff = min(buffers[i][SORT_KEY].iat[-1] for i in live)
+        parts = []
+        for i in live:
+            buf = buffers[i]
+            n = int(np.searchsorted(buf[SORT_KEY].to_numpy(), cutoff, side="right"))
+            if n:
+                parts.append(buf.iloc[:n])
+            rest = buf.iloc[n:]
+            buffers[i] = rest if len(rest) else next(readers[i], None)
+        # run 编号小的在前，concat 后稳定排序保持原文件中的先后顺序
+        yield pd.concat(parts, ignore_index=True).sort_values(SORT_KEY, kind="stable")
+
+
+def external_sort(chunks, chunksize=200_000, directory=None, fan_in=FAN_IN):
+    """
+    外部归并排序：每个块在内存中稳定排序后落盘，再做 k 路归并
+    落盘后才知道 run 的个数，归并时每个 run 读入 chunksize // run 数 行，合计约一个块；
+    run 多于 fan_in 个时先分组归并成更长的 run，内存占用与文件大小无关
+    """
+    block = max(1, chunksize // fan_in)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        runs = [_write_run([_plain(chunk).sort_values(SORT_KEY, kind="stable")], tmp, block)
+                for chunk in chunks if len(chunk)]
+        while len(runs) > fan_in:
+            merged = []
+            for i in range(0, len(runs), fan_in):
+                group = runs[i:i + fan_in]
+                rows = max(block, chunksize // len(group))
+                merged.append(_write_run(_merge([_read_run(p, rows) for p in group]), tmp, block))
+                for path in group:
+                    os.unlink(path)
+            runs = merged
+        if runs:
+            rows = max(block, chunksize // len(runs))
+            yield from _merge([_read_run(p, rows) for p in runs])
+
+
+def stream_sorted(path, time_column, chunksize=200_000, schema=None, assume_sorted=None):
+    """
+    按时间顺序逐块产出交易记录
+    assume_sorted=None 时先扫描一遍判断；已排序直接流式读取，否则走外部归并排序
+    """
+    if assume_sorted is None:
+        assume_sorted = is_time_sorted(path, time_column, chunksize, schema)
+    chunks = read_chunks(path, time_column, chunksize, schema)
+    if assume_sorted:
+        yield from chunks
+    else:
+        print("交易记录未按时间排序，使用外部归并排序")
+        yield from external_sort(chunks, chunksize)
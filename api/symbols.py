@@ -0,0 +1,115 @@
+import threading
+import numpy as np
+import pandas as pd
+
+# 期权代码: [市场.]标的 + 到期日(yymmdd) + C/P + 行权价(×1000)[.市场]
+# 例如 HK.TCH230530P320000、US.AAPL230616C185000、TCH230530P320000.HK
+OPTION_PATTERN = (
+    r"^(?:(?P<prefix>HK|US|SH|SZ|SG)\.)?"
+    r"(?P<underlying>[A-Z\.]+?)"
+    r"(?P<expiry>[0-9]{6})(?P<right>[CP])(?P<strike>[0-9]+)"
+)
+STOCK_PATTERN = r"^(?:(?P<prefix>HK|US|SH|SZ|SG)\.)?(?P<underlying>.*?)(?:\.(?P<suffix>HK|US|SH|SZ|SG))?$"
+
+# 默认合约乘数，按市场区分；config.yaml 中 symbols.multipliers 可按标的覆盖
+DEFAULT_MULTIPLIERS = {
+    "HK": 500,  # 港股期权：500股/张
+    "US": 100,  # 美股期权：100股/张
+}
+
+FIELDS = ["type", "underlying", "expiry", "right", "strike", "market", "multiplier"]
+
+
+def parse_symbols(symbols):
+    """
+    向量化解析一批（去重后的）代码，返回以 symbol 为索引的 DataFrame
+    type 为 option / stock；非期权的 expiry / right / strike 为空
+    multiplier 为每张合约的股数：股票为 1，期权按市场取 DEFAULT_MULTIPLIERS，市场未知时为空
+    """
+    codes = pd.Series(pd.unique(pd.Series(symbols, dtype=object).dropna()), dtype=object)
+    text = codes.astype(str).str.strip()
+    opt = text.str.extract(OPTION_PATTERN)
+    stock = text.str.extract(STOCK_PATTERN)
+
+    # 00-49 为 2000-2049，50-99 为 1950-1999；日期不合法时不视作期权
+    yy = pd.to_numeric(opt["expiry"].str[:2], errors="coerce")
+    century = np.where(yy >= 50, "19", "20")
+    expiry = pd.to_datetime(century + opt["expiry"].fillna(""), format="%Y%m%d", errors="coerce")
+    is_option = expiry.notna()
+
+    market = opt["prefix"].fillna(stock["prefix"]).fillna(stock["suffix"])
+    table = pd.DataFrame({
+        "type": np.where(is_option, "option", "stock"),
+        "underlying": opt["underlying"].where(is_option, stock["underlying"]).str.rstrip("."),
+        "expiry": expiry,
+        "right": opt["right"].where(is_option),
+        "strike": (pd.to_numeric(opt["strike"], errors="coerce") / 1000).where(is_option),
+        "market": market,
+        "multiplier": np.where(is_option, market.map(DEFAULT_MULTIPLIERS).astype(float), 1.0),
+    })
+    table.index = pd.Index(codes, name="symbol")
+    return table
+
+
+class SymbolRegistry:
+    """
+    代码元数据表：每个不同的代码只解析一次，之后按代码查表
+    """
+
+    def __init__(self):
+        self.table = pd.DataFrame(columns=FIELDS, index=pd.Index([], dtype=object, name="symbol"))
+        self.lock = threading.Lock()
+
+    def lookup(self, symbols):
+        """返回 symbols 中每个不同代码的元数据，按需补充解析新代码"""
+        unique = pd.unique(pd.Series(symbols, dtype=object).dropna())
+        with self.lock:
+            missing = unique[~pd.Index(unique).isin(self.table.index)]
+            if len(missing):
+                parsed = parse_symbols(missing)
+                self.table = parsed if self.table.empty else pd.concat([self.table, parsed])
+            return self.table.loc[unique]
+
+    def is_option(self, symbols):
+        """逐行返回是否期权"""
+        symbols = pd.Series(symbols, dtype=object)
+        kind = symbols.map(self.lookup(symbols)["type"])
+        return (kind == "option").to_numpy()
+
+    def contract_shares(self, symbols, markets, multipliers=None):
+        """
+        逐行返回每张合约对应的股数，股票为 1
+        markets 为每行的市场（HK / US，来自成交记录），为空时用代码表里的乘数；
+        multipliers 为 {标的: 乘数} 的覆盖表
+        期权找不到乘数（市场不在 DEFAULT_MULTIPLIERS 中且没有覆盖）时抛出 ValueError
+        """
+        symbols = pd.Series(symbols, dtype=object).reset_index(drop=True)
+        info = self.lookup(symbols)
+        is_option = (symbols.map(info["type"]) == "option").to_numpy()
+        market = pd.Series(markets, dtype=object).reset_index(drop=True)
+        shares = market.map(DEFAULT_MULTIPLIERS).astype(float) \
+            .where(market.notna(), symbols.map(info["multiplier"]).astype(float))
+        if multipliers:
+            override = symbols.map(info["underlying"]).map(multipliers).astype(float)
+            shares = override.fillna(shares)
+        unknown = is_option & shares.isna().to_numpy()
+        if unknown.any():
+            raise ValueError(f"以下期权的市场没有默认合约乘数，请在 config.yaml 的 symbols.multipliers 中指定: "
+                             f"{sorted(symbols[unknown].unique())}")
+        return np.where(is_option, shares.to_numpy(), 1.0)
+
+    def expiries(self, symbols):
+        """返回 {symbol: 到期日}，只包含期权"""
+        info = self.lookup(symbols)
+        info = info[info["type"] == "option"]
+        return dict(zip(info.index, info["expiry"]))
+
+
+_default_registry = None
+
+
+def get_registry():
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = SymbolRegistry()
+    return _default_registry
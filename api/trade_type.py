@@ -3,6 +3,8 @@ import pandas as pd
 
 
 class Stock:
+    __slots__ = ("qty", "cost", "symbol", "currency", "bonus", "bonus_by_year")
+
     def __init__(self, symbol, currency) -> None:
         self.qty = 0                  # 做空 < 0, 做多 > 0
         self.cost = 0.0               # cost = qty * avg_price（允许为负）
@@ -19,24 +21,27 @@ class Stock:
         return self.cost / self.qty
 
     def _add_bonus(self, realized, updated_at):
-        """把已实现收益同时记录到总额与年度"""
+        """把已实现收益同时记录到总额与年度，updated_at 可以直接传入年份 int"""
         if realized == 0:
             return
 
         self.bonus += realized
 
-        # ---- 情况 1：已经是 datetime / Timestamp ----
-        if isinstance(updated_at, (datetime, pd.Timestamp)):
-            dt = updated_at
+        # ---- 情况 1：已经预先算好的年份 ----
+        if isinstance(updated_at, int):
+            year = updated_at
+
+        # ---- 情况 2：已经是 datetime / Timestamp ----
+        elif isinstance(updated_at, (datetime, pd.Timestamp)):
+            year = updated_at.year
 
-        # ---- 情况 2：字符串（可能有/没有毫秒）----
+        # ---- 情况 3：字符串（可能有/没有毫秒）----
         else:
             try:
-                dt = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S.%f")
+                year = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S.%f").year
             except ValueError:
-                dt = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S")
+                year = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S").year
 
-        year = dt.year
         self.bonus_by_year[year] = self.bonus_by_year.get(year, 0.0) + realized
 
     def buy(self, price, qty, free, updated_at, shares=1):
@@ -1,17 +1,18 @@
-from .utils import RateLimiter, parse_option_expiry_from_symbol
-from futu import *
+from . import dedup, fake_broker, metrics, store
+from .utils import CSV_SCHEMAS, ContextThreadPool, get_rate_limiter
+from .symbols import get_registry
+from .cashflow import FEE_CATEGORIES, futu_cash_events
+import numpy as np
 import pandas as pd
 import os
+import threading
 from datetime import datetime, timedelta
-import time
-from futu import *
-from .trade_type import Stock
+from .checkpoint import run_engine, source_tag
+from .streaming import stream_sorted
 from .utils import safe_read_csv
-# 频率限制参数
-MAX_REQUESTS = 20
-TIME_WINDOW = 35  # 秒
 
 
+@metrics.timed("fee.dedup")
 def remove_repeated_fee(df):
     # 组合策略里 订单 id 都是同一个，导致合计手续费被重复计算了，只统计第一个，其他改为 0
     # 1. 同样，先排序
@@ -25,27 +26,129 @@ def remove_repeated_fee(df):
     return df
 
 
-def get_cash_flow(output_path, start_date, end_date):
+def load_holidays(path):
+    """读取本地休市日历（CSV，需包含 date 列），文件不存在时返回空集合"""
+    if not path or not os.path.exists(path):
+        return set()
+    df = safe_read_csv(path)
+    return set(pd.to_datetime(df["date"], errors="coerce").dropna().dt.date)
+
+
+def _queried_path(output_path):
+    # 记录每个账户已经查询过的日期，包括没有流水的日期
+    return f"{output_path}.queried.csv"
+
+
+def load_queried_dates(output_path):
+    """返回 {acc_id: set(date)}"""
+    path = _queried_path(output_path)
+    if not os.path.exists(path):
+        return {}
+    df = safe_read_csv(path)
+    dates = pd.to_datetime(df["clearing_date"], errors="coerce").dt.date
+    queried = {}
+    for acc_id, d in zip(df["acc_id"].astype(int), dates):
+        queried.setdefault(acc_id, set()).add(d)
+    return queried
+
+
+def settlement_dates_from_trades(trade_path, holidays=(), settlement_days=2):
+    """由交易缓存推出可能产生现金流水的日期：成交日及其后 settlement_days 个交易日"""
+    trades = store.read_table(trade_path, "futu_trade", ["create_time"])
+    trade_days = sorted(set(trades["create_time"].dropna().dt.date))
+    dates = set()
+    for d in trade_days:
+        dates.add(d)
+        added, cur = 0, d
+        while added < settlement_days:
+            cur += timedelta(days=1)
+            if cur.weekday() < 5 and cur not in holidays:
+                dates.add(cur)
+                added += 1
+    return dates
+
+
+def plan_cash_flow_dates(start_date, end_date, holidays=(), skip=(), only=None, skip_weekends=True):
+    """
+    生成需要查询的清算日期
+    去掉周末、休市日和已查询过的日期；only 不为 None 时只保留其中的日期
+    """
+    dates = []
+    d = start_date.date() if isinstance(start_date, datetime) else start_date
+    end = end_date.date() if isinstance(end_date, datetime) else end_date
+    while d <= end:
+        if not (skip_weekends and d.weekday() >= 5) and d not in holidays \
+                and d not in skip and (only is None or d in only):
+            dates.append(d)
+        d += timedelta(days=1)
+    return dates
+
+
+# futu SDK 只在真正下载时才导入，计算已缓存数据不需要它
+def _fetch_account_cash_flow(trd_ctx, acc_id, dates, rate_limiter, on_date=None, cancel=None):
+    from futu import RET_OK, TrdEnv, CashFlowDirection
+    frames, done = [], []
+    print(f"处理账户: {acc_id}，需查询 {len(dates)} 天")
+    for clearing_date in dates:
+        if cancel is not None and cancel.is_set():
+            print(f"[{acc_id}] 已取消")
+            break
+        clearing_date = clearing_date.strftime('%Y-%m-%d')
+        print(f"[{acc_id}] 查询日期: {clearing_date}")
+        rate_limiter.acquire()
+        with metrics.span("api.futu.cash_flow", acc_id=acc_id):
+            ret, data = trd_ctx.get_acc_cash_flow(
+                clearing_date=clearing_date,
+                trd_env=TrdEnv.REAL,
+                acc_id=acc_id,
+                cashflow_direction=CashFlowDirection.NONE
+            )
+        metrics.incr("api_calls.futu.cash_flow")
+        if ret == RET_OK:
+            data['acc_id'] = acc_id
+            frames.append(data)
+            done.append(clearing_date)
+        else:
+            print(f"获取现金流水失败: {data}")
+        if on_date is not None:
+            on_date(acc_id, clearing_date)
+    return frames, done
+
+
+def get_cash_flow(output_path, start_date, end_date, holiday_file=None, trade_path=None,
+                  skip_weekends=True, progress=None, cancel=None):
+    """
+    按天下载现金流水
+
+    跳过周末、holiday_file 中的休市日以及每个账户已查询过的日期；
+    提供 trade_path 时只查询交易缓存推出的结算日期。
+    多个账户并发下载，共享同一个请求配额。
+    progress(已完成, 总数, 最近完成的日期) 报告进度；cancel.is_set() 后停止查询，
+    已下载的部分照常保存，下次调用时自动跳过
+    """
+    fake_broker.install_from_env()
+    from futu import RET_OK, OpenSecTradeContext, SecurityFirm, TrdEnv, TrdMarket
+
     # 创建交易上下文
     trd_ctx = OpenSecTradeContext(filter_trdmarket=TrdMarket.NONE, host='127.0.0.1',
                                   port=11111, security_firm=SecurityFirm.FUTUSECURITIES)
 
     all_cash_flow = []
-    rate_limiter = RateLimiter(MAX_REQUESTS, TIME_WINDOW)
+    queried_rows = []
+    rate_limiter = get_rate_limiter("futu.cash_flow")
     try:
         # 获取账户列表
         ret, acc_list_df = trd_ctx.get_acc_list()
         if ret != RET_OK or not isinstance(acc_list_df, pd.DataFrame):
-            print(f'获取账户列表失败: {acc_list_df}')
-            exit(1)
+            raise RuntimeError(f'获取账户列表失败: {acc_list_df}')
 
-        # 日期范围
-        date_list = []
-        d = start_date
-        while d <= end_date:
-            date_list.append(d.strftime('%Y-%m-%d'))
-            d += timedelta(days=1)
+        holidays = load_holidays(holiday_file)
+        queried = load_queried_dates(output_path)
+        only = None
+        if trade_path is not None and os.path.exists(trade_path):
+            only = settlement_dates_from_trades(trade_path, holidays)
 
+        plans = {}
         for _, acc_row in acc_list_df.iterrows():
             acc_id = acc_row.get('acc_id')
             if acc_row.get('trd_env') == TrdEnv.SIMULATE:
@@ -57,68 +160,182 @@ def get_cash_flow(output_path, start_date, end_date):
             except Exception:
                 print(f"无效的账户ID: {acc_id}")
                 continue
-            print(f"处理账户: {acc_id}")
-            for clearing_date in date_list:
-                print(f"查询日期: {clearing_date}")
-                rate_limiter.wait_if_needed()
-                ret, data = trd_ctx.get_acc_cash_flow(
-                    clearing_date=clearing_date,
-                    trd_env=TrdEnv.REAL,
-                    acc_id=acc_id,
-                    cashflow_direction=CashFlowDirection.NONE
-                )
-                if ret == RET_OK:
-                    data['acc_id'] = acc_id
-                    all_cash_flow.append(data)
-                else:
-                    print(f"获取现金流水失败: {data}")
+            plans[acc_id] = plan_cash_flow_dates(
+                start_date, end_date, holidays, queried.get(acc_id, set()), only, skip_weekends)
+
+        total = sum(len(dates) for dates in plans.values())
+        counter = [0]
+        lock = threading.Lock()
+
+        def on_date(acc_id, clearing_date):
+            with lock:
+                counter[0] += 1
+                if progress is not None:
+                    progress(counter[0], total, clearing_date)
+
+        with ContextThreadPool(max_workers=max(1, len(plans))) as pool:
+            futures = {
+                acc_id: pool.submit(_fetch_account_cash_flow, trd_ctx, acc_id, dates,
+                                    rate_limiter, on_date, cancel)
+                for acc_id, dates in plans.items()
+            }
+            for acc_id, future in futures.items():
+                frames, done = future.result()
+                all_cash_flow.extend(frames)
+                queried_rows.extend((acc_id, d) for d in done)
 
         if not all_cash_flow:
             print("所有账户都未获取到现金流水")
         else:
+            # 按 (acc_id, cashflow_id) 去重后追加到已有缓存
             final_df = pd.concat(all_cash_flow, ignore_index=True)
             if len(final_df) > 0:
-                final_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+                store.append_new(output_path, final_df, "futu_cash")
                 print(f"已导出到 {output_path}")
+
+        # 流水写入成功后再记录已查询日期
+        if queried_rows:
+            pd.DataFrame(queried_rows, columns=["acc_id", "clearing_date"]).to_csv(
+                _queried_path(output_path), mode="a", index=False,
+                header=not os.path.exists(_queried_path(output_path)))
     finally:
         trd_ctx.close()
 
 
-def extract_other_fees(path):
-    df = safe_read_csv(path)
+# 富途费用类流水按类别记入不同的账户，股息和预扣税与手续费分开；其余类别记入 FEE-{currency}
+FEE_ACCOUNTS = {"dividend": "DIV", "withholding_tax": "WHT"}
 
-    # 统一字符串
-    df["cashflow_remark"] = df["cashflow_remark"].fillna("").str.upper()
 
-    fee_keywords = [
-        "FEE", "ADR", "INTEREST", "LOAN", "STAMP", "WITHHOLDING TAX", "TAX",
-        "IRO", "REGISTRATION", "DIVIDENDS"
-    ]
+def extract_other_fees(path, use_store=True):
+    """现金流水中的费用类事件（ADR 费、印花税、利息、股息及预扣税、平台费等）"""
+    events = futu_cash_events(path, use_store)
+    return events[events["category"].isin(FEE_CATEGORIES)]
 
-    mask_fee = df["cashflow_remark"].str.contains(
-        "|".join(fee_keywords), na=False)
 
-    fees = df[mask_fee]
+FEE_QUERY_BATCH = 400
 
-    return fees
 
+def _trade_windows(start_date, end_date, window_days=90):
+    """
+    把时间范围切成每 window_days 天一个批次
+    相邻窗口共用边界时刻：成交时间精确到毫秒，而查询参数只到秒，错开一秒会漏掉边界上的成交；
+    边界上重复返回的成交在写入缓存前按 deal_id 去重
+    """
+    windows = []
+    current_start = start_date
+    while current_start < end_date:
+        current_end = min(current_start + timedelta(days=window_days), end_date)
+        windows.append((current_start, current_end))
+        current_start = current_end
+    return windows
 
-def get_trade_flow(output_path, start_date, end_date):
-    # 创建OpenD连接
-    quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
-    # 不指定市场，获取所有市场的交易权限
-    trade_ctx = OpenSecTradeContext(
-        host='127.0.0.1', port=11111, filter_trdmarket=TrdMarket.NONE)
 
-    # 创建请求限制器（30秒内最多10次请求）
-    rate_limiter = RateLimiter(max_requests=10, time_window=50)
+def _drop_known_order_fees(df, index):
+    """订单已有成交在缓存里时，手续费已经记在那笔成交上，新成交的手续费置 0"""
+    known = index.contains(df, "order")
+    if known.any():
+        df = df.copy()
+        df.loc[known, "fee_amount"] = 0
+    return df
+
 
-    # 存储所有账户的所有订单
-    all_accounts_orders = []
+def _query_fees(trade_ctx, acc_id, order_ids, fee_limiter):
+    from futu import RET_OK, TrdEnv
+
+    fee_limiter.acquire()
+    with metrics.span("api.futu.fee_query", acc_id=acc_id):
+        ret, fee_df = trade_ctx.order_fee_query(
+            order_id_list=order_ids, acc_id=acc_id, trd_env=TrdEnv.REAL)
+    metrics.incr("api_calls.futu.fee_query")
+    if ret == RET_OK and isinstance(fee_df, pd.DataFrame):
+        return fee_df[['order_id', 'fee_amount']]
+    print(f'acc_id={acc_id} 获取订单费用失败:', fee_df)
+    return None
+
+
+def _fetch_account_deals(trade_ctx, acc_id, windows, fee_pool, fee_limiter, on_window=None,
+                         cancel=None):
+    """
+    按窗口拉取一个账户的历史成交，拿到 order_id 后立即把费用查询提交到 fee_pool，
+    与后续窗口的成交查询并行进行
+    """
+    from futu import RET_OK, TrdMarket
+
+    deal_limiter = get_rate_limiter("futu.history_deal", key=acc_id)
+    frames, fee_futures = [], []
+    seen_ids, pending_ids = set(), []
+
+    def flush_fees(force=False):
+        while len(pending_ids) >= FEE_QUERY_BATCH or (force and pending_ids):
+            batch = pending_ids[:FEE_QUERY_BATCH]
+            del pending_ids[:FEE_QUERY_BATCH]
+            fee_futures.append(fee_pool.submit(_query_fees, trade_ctx, acc_id, batch, fee_limiter))
+
+    for i, (window_start, window_end) in enumerate(windows, 1):
+        if cancel is not None and cancel.is_set():
+            print(f"[{acc_id}] 已取消")
+            break
+        deal_limiter.acquire()
+        with metrics.span("api.futu.history_deal", acc_id=acc_id):
+            ret, data = trade_ctx.history_deal_list_query(
+                acc_id=acc_id,
+                deal_market=TrdMarket.NONE,
+                start=window_start.strftime('%Y-%m-%d %H:%M:%S'),
+                end=window_end.strftime('%Y-%m-%d %H:%M:%S'),
+            )
+        metrics.incr("api_calls.futu.history_deal")
+
+        if ret != RET_OK:
+            print(f'[{acc_id}] 获取历史订单失败: {data}')
+            data = None
+        elif not isinstance(data, pd.DataFrame):
+            try:
+                data = pd.DataFrame(data)
+            except Exception as e:
+                print(f"[{acc_id}] 数据无法转为DataFrame: {e}")
+                data = None
+
+        count = 0
+        if data is not None and not data.empty:
+            data['acc_id'] = acc_id
+            frames.append(data)
+            count = len(data)
+            if 'order_id' in data.columns:
+                for order_id in data['order_id'].unique().tolist():
+                    if order_id not in seen_ids:
+                        seen_ids.add(order_id)
+                        pending_ids.append(order_id)
+                flush_fees()
+
+        print(f"[{acc_id}] {i}/{len(windows)} {window_start.strftime('%Y-%m-%d')} 到 "
+              f"{window_end.strftime('%Y-%m-%d')}: {count} 条成交")
+        if on_window is not None:
+            on_window(acc_id, i)
+
+    flush_fees(force=True)
+    fees = [f.result() for f in fee_futures]
+    return frames, [f for f in fees if f is not None]
+
+
+def get_trade_flow(output_path, start_date, end_date, window_days=90, progress=None,
+                   cancel=None, replace=False):
+    """
+    下载所有真实账户的历史成交和订单费用
+
+    不同账户的时间窗口并发查询，各自使用独立的成交查询配额；
+    费用查询在拿到 order_id 后立即开始，共享单独的费用查询配额。
+    progress(已完成窗口数, 总窗口数, 所有账户都已完成的最晚日期) 报告进度；
+    cancel.is_set() 后不再开始新的窗口，已下载的窗口照常保存。
+    默认只把缓存里没有的 deal_id 追加到文件末尾（已有的成交保持不变）；
+    replace=True 时用本次下载的结果覆盖整个缓存，中途取消时仍然只追加，不会用部分结果覆盖
+    """
+    fake_broker.install_from_env()
+    from futu import RET_OK, OpenSecTradeContext, TrdEnv, TrdMarket
 
-    # 定义要查询的市场列表
-    # markets_to_query = [TrdMarket.US, TrdMarket.HK]
-    markets_to_query = [TrdMarket.NONE]
+    # 不指定市场，获取所有市场的交易权限
+    trade_ctx = OpenSecTradeContext(
+        host='127.0.0.1', port=11111, filter_trdmarket=TrdMarket.NONE)
+    fee_limiter = get_rate_limiter("futu.fee_query")
 
     try:
         # 获取账户列表
@@ -127,68 +344,40 @@ def get_trade_flow(output_path, start_date, end_date):
             print(f'获取账户列表失败: {acc_list_df}')
             return
 
-        # 遍历所有账户
+        accounts = []
         for _, acc_row in acc_list_df.iterrows():
             acc_id = acc_row.get('acc_id')
             if acc_row.get("trd_env") == TrdEnv.SIMULATE:
                 continue
             if acc_id is None:
                 continue
-
             try:
-                acc_id = int(acc_id)
+                accounts.append(int(acc_id))
             except (ValueError, TypeError):
                 print(f"无效的账户ID: {acc_id}")
-                continue
 
-            print(f"\n开始处理账户: {acc_id}")
-
-            # 遍历所有市场
-            for market in markets_to_query:
-
-                # 每3个月为一个批次
-                current_start = start_date
-
-                while current_start < end_date:
-                    # 计算当前批次的结束时间
-                    current_end = min(
-                        current_start + timedelta(days=90), end_date)
-
-                    print(
-                        f"正在获取 {current_start.strftime('%Y-%m-%d')} 到 {current_end.strftime('%Y-%m-%d')} 的订单数据...")
-
-                    # 等待请求限制
-                    rate_limiter.wait_if_needed()
-
-                    # 查询历史订单, 明确指定市场
-                    ret, data = trade_ctx.history_deal_list_query(
-                        acc_id=acc_id,
-                        deal_market=market,
-                        start=current_start.strftime('%Y-%m-%d %H:%M:%S'),
-                        end=current_end.strftime('%Y-%m-%d %H:%M:%S'),
-                    )
-
-                    if ret != RET_OK:
-                        print(f'获取历史订单失败: {data}')
-
-                    if isinstance(data, pd.DataFrame) and not data.empty:
-                        data['acc_id'] = acc_id  # 新增：为每个订单加上acc_id
-                        all_accounts_orders.append(data)
-                        print(f"成功获取 {len(data)} 条订单记录")
-                    elif data is not None:
-                        # 如果不是DataFrame但有内容，尝试转为DataFrame并追加acc_id
-                        try:
-                            data_df = pd.DataFrame(data)
-                            if not data_df.empty:
-                                data_df['acc_id'] = acc_id
-                                all_accounts_orders.append(data_df)
-                                print(
-                                    f"成功获取 {len(data_df)} 条订单记录 (非DataFrame原始类型)")
-                        except Exception as e:
-                            print(f"数据无法转为DataFrame: {e}")
-
-                    # 更新下一批次的开始时间
-                    current_start = current_end
+        windows = _trade_windows(start_date, end_date, window_days)
+        done = {acc_id: 0 for acc_id in accounts}
+        lock = threading.Lock()
+
+        def on_window(acc_id, i):
+            with lock:
+                done[acc_id] = i
+                if progress is not None:
+                    finished = min(done.values())
+                    progress(sum(done.values()), len(windows) * len(accounts),
+                             windows[finished - 1][1] if finished else None)
+
+        all_accounts_orders, fee_list = [], []
+        with ContextThreadPool(max_workers=2) as fee_pool, \
+                ContextThreadPool(max_workers=max(1, len(accounts))) as acc_pool:
+            futures = [acc_pool.submit(_fetch_account_deals, trade_ctx, acc_id, windows,
+                                       fee_pool, fee_limiter, on_window, cancel)
+                       for acc_id in accounts]
+            for future in futures:
+                frames, fees = future.result()
+                all_accounts_orders.extend(frames)
+                fee_list.extend(fees)
 
         if not all_accounts_orders:
             print("所有账户和市场都未找到任何订单记录")
@@ -202,39 +391,18 @@ def get_trade_flow(output_path, start_date, end_date):
             final_df = final_df.sort_values(
                 by='create_time', ascending=False, kind='stable')
 
-        # ====== 新增：批量获取订单费用 ======
-        if 'order_id' in final_df.columns and 'acc_id' in final_df.columns:
-            fee_list = []
-            batch_size = 400
-            # 按账户分组批量查费用
-            for acc_id_val, group in final_df.groupby('acc_id'):
-                # 只处理int或str类型的acc_id
-                if not isinstance(acc_id_val, (int, str)):
-                    print(f'不支持的acc_id类型: {type(acc_id_val)}, 跳过该分组')
-                    continue
-                try:
-                    acc_id_int = int(str(acc_id_val))
-                except Exception:
-                    print(f'无法转换acc_id: {acc_id_val}，跳过该分组')
-                    continue
-                order_ids = group['order_id'].tolist()
-                for i in range(0, len(order_ids), batch_size):
-                    batch_ids = order_ids[i:i+batch_size]
-                    ret, fee_df = trade_ctx.order_fee_query(
-                        order_id_list=batch_ids, acc_id=acc_id_int, trd_env=TrdEnv.REAL)
-                    if ret == RET_OK and isinstance(fee_df, pd.DataFrame):
-                        fee_list.append(fee_df[['order_id', 'fee_amount']])
-                    else:
-                        print(f'acc_id={acc_id_int} 获取订单费用失败:', fee_df)
+        # 合并费用到订单表
+        if 'order_id' in final_df.columns:
             if fee_list:
                 all_fee_df = pd.concat(fee_list, ignore_index=True)
             else:
                 all_fee_df = pd.DataFrame(columns=['order_id', 'fee_amount'])
-            # 合并费用到订单表
             final_df = final_df.merge(all_fee_df, on='order_id', how='left')
         else:
             final_df['fee_amount'] = 0
-        # ====== 新增结束 ======
+
+        # 相邻窗口在边界时刻重叠，同一笔成交可能出现两次
+        final_df = dedup.unique_rows(final_df, "futu_trade")
 
         # 打印最终结果的汇总信息
         print(final_df)
@@ -242,90 +410,134 @@ def get_trade_flow(output_path, start_date, end_date):
 
         # 保存结果到统一的CSV文件
         if len(final_df) > 0:
-            final_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+            if replace and not (cancel is not None and cancel.is_set()):
+                store.write_all(output_path, final_df, "futu_trade")
+            else:
+                store.append_new(output_path, final_df, "futu_trade", prepare=_drop_known_order_fees)
             print(f"\n所有账户数据已合并保存到 {output_path}")
 
     finally:
         # 关闭连接
-        quote_ctx.close()
         trade_ctx.close()
 
 
-def format_trade(data_path, cash_path=None, check_expiry=True, check_date=None):
-    data = (
-        safe_read_csv(data_path)
-        .assign(updated_time=lambda df: pd.to_datetime(df["create_time"], errors="coerce"))
-        .sort_values(by="updated_time", ascending=True)
-    )
+def to_engine_trades(data, multipliers=None):
+    """
+    把富途成交记录（需已有 updated_time 列）转换成引擎输入
+    multipliers 为按标的覆盖的合约乘数
+    """
     data = data[data["qty"] > 0]
 
-    pool = {}
-
     market2currency = {
         "HK": "HKD",
         "US": "USD",
     }
 
-    contract_multiplier = {
-        "HK": 500,  # 港股期权：500股/张
-        "US": 100,   # 美股期权：100股/张
-    }
-
-    for _, row in data.iterrows():
-        symbol = row["code"]
-        expiry_date, is_option = parse_option_expiry_from_symbol(symbol)
-        shares = 1 if not is_option else contract_multiplier[row["deal_market"]]
-        if symbol not in pool:
-            pool[symbol] = Stock(symbol, market2currency[row["deal_market"]])
-        if "SELL" in row["trd_side"]:
-            pool[symbol].sell(row["price"], row["qty"],
-                              row["fee_amount"], row["updated_time"], shares)
-        else:
-            pool[symbol].buy(row["price"], row["qty"],
-                             row["fee_amount"], row["updated_time"], shares)
-
-        # 2. 检查并处理过期期权（新增逻辑）
+    shares = get_registry().contract_shares(data["code"], data["deal_market"], multipliers)
+    return pd.DataFrame({
+        "symbol": data["code"],
+        "currency": data["deal_market"].map(market2currency),
+        "is_sell": data["trd_side"].str.contains("SELL", regex=False),
+        "price": data["price"],
+        "qty": data["qty"],
+        "fee": data["fee_amount"],
+        "updated_at": data["updated_time"],
+        "shares": shares,
+    })
+
+
+@metrics.timed("engine.expiry")
+def expire_options(engine, check_date=None):
+    """把已过期且仍有持仓的期权按零价值平仓"""
+    if check_date is None:
+        check_date = datetime.now()
+    ledger = engine.ledger
+
+    held = np.flatnonzero(ledger.qty[:ledger.size] != 0)
+    expiries = get_registry().expiries([ledger.symbols[sid] for sid in held])
+
+    expired_count = 0
+    for sid in held:
+        symbol = ledger.symbols[sid]
+        expiry_date = expiries.get(symbol)
+        # 如果期权已过期，使用到期日当天作为记录时间
+        if expiry_date is not None and check_date >= expiry_date:
+            qty = ledger.qty[sid]
+            loss = engine.close_out(sid, expiry_date.year, expiry_date)
+            print(f"期权失效处理: {symbol}, 到期日: {expiry_date.date()}, "
+                  f"持仓量: {abs(qty)}, 损失: {loss:.2f}")
+            expired_count += 1
+
+    if expired_count > 0:
+        print(f"已处理 {expired_count} 个过期期权")
+    return expired_count
+
+
+TRADE_COLUMNS = CSV_SCHEMAS["futu_trade"]["usecols"]
+
+
+def _stream_engine_trades(data_path, chunksize, multipliers=None, use_store=True):
+    if use_store:
+        chunks = store.read_chunks(data_path, "futu_trade", chunksize, TRADE_COLUMNS)
+    else:
+        chunks = stream_sorted(data_path, "create_time", chunksize, schema="futu_trade")
+    for chunk in chunks:
+        chunk["updated_time"] = pd.to_datetime(chunk["create_time"], errors="coerce")
+        yield to_engine_trades(chunk, multipliers)
+
+
+def format_trade(data_path, cash_path=None, check_expiry=True, check_date=None, chunksize=None,
+                 method="average", checkpoint_dir=None, multipliers=None, use_store=True):
+    """
+    计算富途账户每个标的的已实现收益
+    chunksize 不为空时按时间顺序分块流式处理，峰值内存只和持仓标的数量有关
+    method 为成本计算方法：average 移动平均，fifo 先进先出
+    checkpoint_dir 不为空时使用年末检查点，只回放最近一个有效检查点之后的成交
+    multipliers 为 {标的: 合约乘数}，覆盖按市场的默认期权乘数
+    use_store 为 True 时通过带类型缓存（store）读取，否则直接解析 CSV
+    """
+    if chunksize:
+        def make_frames():
+            return _stream_engine_trades(data_path, chunksize, multipliers, use_store)
+    else:
+        data = store.read_table(data_path, "futu_trade", TRADE_COLUMNS, use_store)
+        data["updated_time"] = pd.to_datetime(data["create_time"], errors="coerce")
+        if not use_store:
+            data = data.sort_values(by="updated_time", ascending=True)
+        trades = to_engine_trades(data, multipliers)
+
+        def make_frames():
+            return iter([trades])
+    engine = run_engine(make_frames, method, checkpoint_dir, source_tag("futu", data_path))
+    ledger = engine.ledger
+
+    # 2. 检查并处理过期期权
     if check_expiry:
-        if check_date is None:
-            check_date = datetime.now()
-
-        expired_count = 0
-        for symbol, stock_obj in pool.items():
-            # 解析期权到期日
-            expiry_date, is_option = parse_option_expiry_from_symbol(symbol)
-            print(expiry_date, check_date)
-
-            if is_option and expiry_date and stock_obj.qty != 0:
-                # 如果期权已过期
-                if check_date >= expiry_date:
-                    # 使用到期日当天时间作为记录时间
-                    stock_obj.expire_option(expiry_date, expiry_date)
-                    expired_count += 1
-
-        if expired_count > 0:
-            print(f"已处理 {expired_count} 个过期期权")
+        expire_options(engine, check_date)
 
     if cash_path is not None:
-        fees = extract_other_fees(cash_path)
-
-        fees = fees.assign(
-            ts=lambda df: pd.to_datetime(df["clearing_date"], errors="coerce")
-        ).sort_values("ts")
-
-        for _, r in fees.iterrows():
-            currency = r.get("currency", "").upper()
-            if not currency:
-                continue
-
-            # —— 为每个币种创建“费用账户” —— #
-            fee_symbol = f"FEE-{currency}"
-
-            if fee_symbol not in pool:
-                pool[fee_symbol] = Stock(fee_symbol, currency)
-
-            amount = float(r["cashflow_amount"])   # 负数=扣费；正数=退款
-
-            # futu的扣费是负数
-            pool[fee_symbol].add_fee(-amount, r["ts"])
-
+        fees = extract_other_fees(cash_path, use_store)
+        fees = fees[fees["currency"].notna() & (fees["currency"] != "") & fees["time"].notna()]
+
+        # —— 为每个币种创建“费用账户”（股息 DIV-、预扣税 WHT-、其余 FEE-） —— #
+        # futu的流水金额带符号：负数=扣费；正数=退款或股息入账
+        account = fees["category"].astype(object).map(FEE_ACCOUNTS)
+        names = (account.fillna("FEE") + "-" + fees["currency"]).to_numpy(dtype=object)
+        currencies = fees["currency"].to_numpy(dtype=object)
+        amounts = fees["amount"].to_numpy(dtype=float)
+        years = fees["year"].to_numpy(dtype=np.int64)
+        times = fees["time"].to_numpy()
+
+        # 股息和预扣税按原符号记入收益，股息入账为正，预扣税或冲回为负
+        income = account.notna().to_numpy()
+        if income.any():
+            uniq, first, inverse = np.unique(names[income], return_index=True, return_inverse=True)
+            sids = ledger.sids(uniq, currencies[income][first])
+            ledger.add_realized(sids[inverse], years[income], amounts[income], times[income])
+
+        # 其余为真正的费用，add_fees 只记 fee > 0（扣费），退款被忽略
+        ledger.add_fees(names[~income], currencies[~income], -amounts[~income],
+                        years[~income], times[~income])
+
+    pool = ledger.to_pool()
     return pool
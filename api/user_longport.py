@@ -1,14 +1,17 @@
 from datetime import datetime
 from pickletools import floatnl
 from token import COLONEQUAL
-from longport.openapi import TradeContext, Config, OrderStatus, OpenApiException, OrderChargeDetail
 import pandas as pd
 import time
 from pathlib import Path
 from collections import defaultdict
-import re
-from .trade_type import Stock
-from .utils import parse_option_expiry_from_symbol, safe_read_csv
+import random
+from .checkpoint import run_engine, source_tag
+from .streaming import stream_sorted
+from . import dedup, fake_broker, metrics, store
+from .utils import CSV_SCHEMAS, ContextThreadPool, get_rate_limiter, safe_read_csv
+from .symbols import get_registry
+from .cashflow import longport_cash_events
 
 
 def get_public_attributes(obj):
@@ -16,7 +19,9 @@ def get_public_attributes(obj):
             if not name.startswith('_')]
 
 
+# longport SDK 只在真正下载时才导入，计算已缓存数据不需要它
 def flatten_attributes(cols, row):
+    from longport.openapi import OrderChargeDetail
     new_cols, new_row = [], []
     for col, x in zip(cols, row):
         if isinstance(x, list):
@@ -33,90 +38,196 @@ def flatten_attributes(cols, row):
     return new_cols, new_row
 
 
+# 长桥交易接口限流错误码，配额见 utils.RATE_LIMITS
+ORDER_DETAIL_ERROR_LIMIT = 429002
+
+
 def get_ctx():
+    # 设置了 STOCK_TAX_FAKE_BROKER 时换成本地替身，见 fake_broker
+    fake_broker.install_from_env()
+    from longport.openapi import Config, TradeContext
     config = Config.from_env()
     return TradeContext(config)
 
 
-def load_longport_adr_events(cash_path):
-    adr = safe_read_csv(cash_path)
+def load_longport_adr_events(cash_path, use_store=True):
+    events = longport_cash_events(cash_path, use_store)
 
-    # 只保留 ADR 费用
-    adr = adr[adr["transaction_flow_name"] == "ADR Fee"].copy()
+    # 只保留能识别 symbol 的 ADR 费用
+    adr = events[(events["category"] == "adr_fee") & events["symbol"].notna()
+                 & events["time"].notna()]
 
     # 费用为正值（balance 是负数）
-    adr["fee"] = adr["balance"].abs()
+    return pd.DataFrame({
+        "symbol": adr["symbol"],
+        "fee": adr["amount"].abs(),
+        "updated_at": adr["time"],
+        "event_type": "adr",
+    })
 
-    # 解析 symbol：优先字段，否则从 description 里抽取
-    def parse_symbol(row):
-        if isinstance(row["symbol"], str) and row["symbol"]:
-            return row["symbol"]
-        m = re.search(r"([A-Z0-9]+\.[A-Z]+)\s+ADR", str(row["description"]))
-        return m.group(1) if m else None
 
-    adr["symbol"] = adr.apply(parse_symbol, axis=1)
+def get_cash_flow(cache_file_path, ctx, start_time=datetime(2022, 1, 1), end_time=datetime.today()):
+    Path(cache_file_path).parent.mkdir(exist_ok=True, parents=True)
+    with metrics.span("api.longport.cash_flow"):
+        resp = ctx.cash_flow(
+            start_at=start_time,
+            end_at=end_time
+        )
+    metrics.incr("api_calls.longport.cash_flow")
+    columns = ['balance', 'business_time', 'business_type', 'currency',
+               'description', 'direction', 'symbol', 'transaction_flow_name']
+    data = []
+    for x in resp:
+        row = [getattr(x, col) for col in columns]
+        data.append(row)
+    df = pd.DataFrame(data, columns=columns)
+    # 流水没有编号，按整行内容去重后追加，重复下载重叠的时间段不会产生重复行
+    if Path(cache_file_path).exists():
+        store.append_new(cache_file_path, df, "longport_cash")
+    else:
+        store.write_all(cache_file_path, df, "longport_cash")
+
 
-    # 只保留能识别 symbol 的记录
-    adr = adr[adr["symbol"].notna()]
+def _cached_range(cache_file_path):
+    """已有交易缓存的 (最早, 最新) updated_at，没有缓存时为 None；直接查带类型缓存的时间索引"""
+    path = Path(cache_file_path)
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    try:
+        return store.time_range(path, "longport_trade")
+    except Exception as e:
+        print(f"读取交易缓存失败，改为全量下载: {e}")
+        return None
 
-    # 标准化时间 & 统一结构
-    adr = adr.rename(columns={"business_time": "updated_at"})
-    adr = adr[["symbol", "fee", "updated_at"]]
-    adr["event_type"] = "adr"
 
-    return adr
+def _fetch_one_detail(ctx, order_id, limiter, max_backoff=30):
+    """带自适应退避的单个 order_detail 请求，失败返回 None"""
+    from longport.openapi import OpenApiException
+    attempt = 0
+    while True:
+        limiter.acquire()
+        metrics.incr("api_calls.longport.order_detail")
+        try:
+            with metrics.span("api.longport.order_detail"):
+                detail = ctx.order_detail(order_id=order_id)
+        except OpenApiException as e:
+            if e.code != ORDER_DETAIL_ERROR_LIMIT:
+                print(e)
+                return None
+            metrics.incr("api_429.longport.order_detail")
+            metrics.incr("api_retries.longport.order_detail")
+            # 指数退避 + 抖动，同时让其他线程一起让出配额
+            delay = min(max_backoff, 2 ** attempt) * random.uniform(0.5, 1.5)
+            limiter.penalize(delay)
+            attempt += 1
+            continue
+        except Exception as e:
+            print(e)
+            return None
+        columns = get_public_attributes(detail)
+        row = [getattr(detail, col) for col in columns]
+        return flatten_attributes(cols=columns, row=row)
 
 
-def get_cash_flow(cache_file_path, ctx, start_time=datetime(2022, 1, 1), end_time=datetime.today()):
-    Path(cache_file_path).parent.mkdir(exist_ok=True, parents=True)
-    resp = ctx.cash_flow(
-        start_at=start_time,
-        end_at=end_time
-    )
-    with open(cache_file_path, 'w') as f:
-        columns = ['balance', 'business_time', 'business_type', 'currency',
-                   'description', 'direction', 'symbol', 'transaction_flow_name']
-        data = []
-        for x in resp:
-            row = [getattr(x, col) for col in columns]
+def fetch_order_details(ctx, order_ids, workers=4, limiter=None, report_every=50,
+                        progress=None, cancel=None):
+    """
+    并发获取订单明细，保持 order_ids 的顺序
+    所有线程共享一个令牌桶，吞吐受配额限制而不是单次往返延迟。
+    cancel.is_set() 后放弃尚未开始的请求，返回的总是 order_ids 的一个前缀；
+    某个订单获取失败时也在此停下，之后的结果不再使用，下次增量同步从该订单重新开始
+    """
+    if limiter is None:
+        limiter = get_rate_limiter("longport.order_detail")
+
+    columns, data = None, []
+    if not order_ids:
+        return columns, data
+
+    started = time.monotonic()
+    with ContextThreadPool(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_fetch_one_detail, ctx, order_id, limiter)
+                   for order_id in order_ids]
+        for i, future in enumerate(futures, 1):
+            if cancel is not None and cancel.is_set():
+                for pending in futures[i - 1:]:
+                    pending.cancel()
+                print(f"已取消，完成 {i - 1}/{len(futures)} 个订单明细")
+                break
+            result = future.result()
+            if result is None:
+                for pending in futures[i:]:
+                    pending.cancel()
+                print(f"订单 {order_ids[i - 1]} 明细获取失败，保存前 {i - 1}/{len(futures)} 个")
+                break
+            columns, row = result
             data.append(row)
-        df = pd.DataFrame(data, columns=columns)
-        df.to_csv(f, index=False, encoding='utf-8-sig')
+            if i % report_every == 0 or i == len(futures):
+                elapsed = time.monotonic() - started
+                print(f"订单明细 {i}/{len(futures)}，"
+                      f"{i / elapsed if elapsed > 0 else 0:.2f} 个/秒")
+            if progress is not None:
+                progress(i, len(futures))
+    return columns, data
+
+
+def get_trade_flow(cache_file_path, ctx, start_time, end_time, incremental=True, workers=4,
+                   progress=None, cancel=None):
+    """
+    下载成交订单明细到缓存 CSV
 
+    incremental=True 时读取已有缓存，只拉取最新 updated_at 之后的订单，
+    并且只对缓存里没有的 order_id 调用 order_detail，结果合并回缓存
+    workers 为同时在途的 order_detail 请求数
+    progress(已完成, 总数, 最近完成订单的 updated_at) 报告进度；取消或某个订单获取失败时
+    保存已获取的部分，订单按时间顺序获取，下次增量同步会从中断处继续
+    """
+    from longport.openapi import OrderStatus
 
-def get_trade_flow(cache_file_path, ctx, start_time, end_time):
     Path(cache_file_path).parent.mkdir(exist_ok=True, parents=True)
-    resp = ctx.history_orders(
-        status=[OrderStatus.Filled],
-        start_at=start_time,
-        end_at=end_time
-    )
-    with open(cache_file_path, 'w') as f:
-        columns = None
-        data = []
-        for x in resp:
-            while True:
-                try:
-                    detail = ctx.order_detail(
-                        order_id=x.order_id,
-                    )
-                    columns = get_public_attributes(detail)
-                    row = [getattr(detail, col) for col in columns]
-                    columns, row = flatten_attributes(cols=columns, row=row)
-                    data.append(row)
-                    break
-                except OpenApiException as e:
-                    if e.code == 429002:
-                        time.sleep(1)
-                    else:
-                        print(e)
-                        break
-                except Exception as e:
-                    print(e)
-                    break
-
-        df = pd.DataFrame(data, columns=columns)
-        df.to_csv(f, index=False, encoding='utf-8-sig')
+
+    cached_range = _cached_range(cache_file_path) if incremental else None
+
+    fetch_start = start_time
+    if cached_range is not None:
+        oldest, newest = cached_range
+        # 缓存已覆盖开始日期时，只需要从最新记录往后拉
+        if oldest <= pd.Timestamp(start_time) <= newest:
+            fetch_start = newest.to_pydatetime()
+            print(f"增量同步：从 {fetch_start} 开始")
+
+    with metrics.span("api.longport.history_orders"):
+        resp = ctx.history_orders(
+            status=[OrderStatus.Filled],
+            start_at=fetch_start,
+            end_at=end_time
+        )
+    metrics.incr("api_calls.longport.history_orders")
+
+    # 按时间顺序获取，中途取消时已保存的总是最早的一段
+    orders = sorted(resp, key=lambda x: x.updated_at)
+    if cached_range is not None and orders:
+        # 只对缓存里没有的 order_id 调用 order_detail
+        with dedup.KeyIndex(cache_file_path, "longport_trade") as index:
+            known = index.contains(pd.DataFrame({"order_id": [x.order_id for x in orders]}), "order")
+        orders = [x for x, k in zip(orders, known) if not k]
+    order_ids = [x.order_id for x in orders]
+
+    def on_detail(done, total):
+        if progress is not None:
+            progress(done, total, orders[done - 1].updated_at)
+
+    columns, data = fetch_order_details(ctx, order_ids, workers=workers,
+                                        progress=on_detail, cancel=cancel)
+
+    print(f"新增 {len(data)} 个订单明细")
+    df = pd.DataFrame(data, columns=columns)
+    if cached_range is not None:
+        # start_time 早于缓存时会补下载更早的订单，追加后 CSV 不再按 updated_at 有序；
+        # 不重写整个文件：带类型缓存按时间索引读取，直接读 CSV 时 stream_sorted 会改用外部归并排序
+        store.append_new(cache_file_path, df, "longport_trade")
+    else:
+        store.write_all(cache_file_path, df, "longport_trade")
 
 
 def get_profile(csv_file_path):
@@ -133,37 +244,79 @@ def get_profile(csv_file_path):
     return dict(profit)
 
 
-def format_longport_trade(data_path, cash_path=None):
-    data = safe_read_csv(data_path).sort_values(
-        by='updated_at', ascending=True)
-    data = data[["charge_detail_currency", "charge_detail_total_amount", "executed_price",
-                 "executed_quantity", "symbol", "price", "side", "quantity", "updated_at"]]
-    pool = {}
-
-    contract_multiplier = {
-        "HKD": 500,  # 港股期权：500股/张
-        "USD": 100,   # 美股期权：100股/张
-    }
-
-    for _, row in data.iterrows():
-        symbol = row["symbol"]
-        expiry_date, is_option = parse_option_expiry_from_symbol(symbol)
-        shares = 1 if not is_option else contract_multiplier[row["charge_detail_currency"]]
-
-        if symbol not in pool:
-            pool[symbol] = Stock(symbol, row["charge_detail_currency"])
-        if row["side"] == "OrderSide.Sell":
-            pool[symbol].sell(row["price"], row["quantity"],
-                              row["charge_detail_total_amount"], row["updated_at"], shares)
-        else:
-            pool[symbol].buy(row["price"], row["quantity"],
-                             row["charge_detail_total_amount"], row["updated_at"], shares)
+# 代码里没有市场时按结算币种推断
+CURRENCY_MARKET = {"HKD": "HK", "USD": "US"}
+
+
+def to_engine_trades(data, multipliers=None):
+    """
+    把长桥订单明细转换成引擎输入
+    multipliers 为按标的覆盖的合约乘数
+    """
+    shares = get_registry().contract_shares(
+        data["symbol"], data["charge_detail_currency"].map(CURRENCY_MARKET), multipliers)
+    return pd.DataFrame({
+        "symbol": data["symbol"],
+        "currency": data["charge_detail_currency"],
+        "is_sell": data["side"] == "OrderSide.Sell",
+        "price": data["price"],
+        "qty": data["quantity"],
+        "fee": data["charge_detail_total_amount"],
+        "updated_at": pd.to_datetime(data["updated_at"], format="ISO8601"),
+        "shares": shares,
+    })
+
+
+TRADE_COLUMNS = CSV_SCHEMAS["longport_trade"]["usecols"]
+
+
+def _stream_engine_trades(data_path, chunksize, multipliers=None, use_store=True):
+    if use_store:
+        chunks = store.read_chunks(data_path, "longport_trade", chunksize, TRADE_COLUMNS)
+    else:
+        chunks = stream_sorted(data_path, "updated_at", chunksize, schema="longport_trade")
+    for chunk in chunks:
+        yield to_engine_trades(chunk, multipliers)
+
+
+def format_longport_trade(data_path, cash_path=None, chunksize=None, method="average",
+                          checkpoint_dir=None, multipliers=None, use_store=True):
+    """
+    计算长桥账户每个标的的已实现收益
+    chunksize 不为空时按时间顺序分块流式处理，峰值内存只和持仓标的数量有关
+    method 为成本计算方法：average 移动平均，fifo 先进先出
+    checkpoint_dir 不为空时使用年末检查点，只回放最近一个有效检查点之后的成交
+    multipliers 为 {标的: 合约乘数}，覆盖按市场的默认期权乘数
+    use_store 为 True 时通过带类型缓存（store）读取，否则直接解析 CSV
+    """
+    if chunksize:
+        def make_frames():
+            return _stream_engine_trades(data_path, chunksize, multipliers, use_store)
+    else:
+        data = store.read_table(data_path, "longport_trade", TRADE_COLUMNS, use_store)
+        if not use_store:
+            data = data.sort_values(by='updated_at', ascending=True)
+        trades = to_engine_trades(data, multipliers)
+
+        def make_frames():
+            return iter([trades])
+    engine = run_engine(make_frames, method, checkpoint_dir, source_tag("longport", data_path))
+    ledger = engine.ledger
 
     if cash_path is not None:
-        from api.user_longport import load_longport_adr_events
-        adr_data = load_longport_adr_events(cash_path)
+        adr_data = load_longport_adr_events(cash_path, use_store)
         print(adr_data)
-        for _, row in adr_data.iterrows():
-            symbol = row["symbol"]
-            pool[symbol].add_fee(row["fee"], row["updated_at"])
+        known = adr_data["symbol"].isin(list(ledger.index))
+        if not known.all():
+            print(f"以下 ADR 费用找不到对应持仓，已跳过: "
+                  f"{sorted(adr_data.loc[~known, 'symbol'].unique())}")
+        adr_data = adr_data[known]
+        ledger.add_fees(
+            adr_data["symbol"].to_numpy(dtype=object),
+            [None] * len(adr_data),
+            adr_data["fee"].to_numpy(dtype=float),
+            adr_data["updated_at"].dt.year.to_numpy(),
+            adr_data["updated_at"].to_numpy(),
+        )
+    pool = ledger.to_pool()
     return pool
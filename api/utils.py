@@ -1,115 +1,370 @@
+import codecs
+import sys
 import time
+import threading
+import asyncio
 import io
+import collections
 import contextlib
-import streamlit as st
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from datetime import datetime
-import re
 import pandas as pd
+from . import metrics
 
-class RateLimiter:
-    def __init__(self, max_requests, time_window):
-        self.max_requests = max_requests
-        self.time_window = time_window
-        self.request_times = []
-
-    def wait_if_needed(self):
-        now = time.time()
-        # 移除过期的请求
-        self.request_times = [t for t in self.request_times if now - t < self.time_window]
-        if len(self.request_times) >= self.max_requests:
-            sleep_time = self.time_window - (now - self.request_times[0])
-            if sleep_time > 0:
-                print(f"请求过多，等待中")
-                time.sleep(sleep_time)
-        self.request_times.append(time.time())
-
-def parse_option_expiry_from_symbol(symbol):
+class TokenBucket:
     """
-    从期权代码解析到期日
-    格式示例: HK.TCH230530P320000 或 TCH230530P320000
-    返回: (到期日datetime, 是否成功解析)
+    线程安全的令牌桶：平均每 time_window 秒放行 max_requests 次，最多攒 burst 个令牌
+    burst=1 时请求被均匀摊开，任意 time_window 内不超过 max_requests + 1 次
+    所有操作都是 O(1)，多个线程 / 协程共享同一个桶即可共同遵守同一份配额
     """
 
-    # 匹配期权格式: 标的代码 + 到期日(yymmdd) + C/P + 行权价
-    pattern = r'[A-Z\.]+([0-9]{6})[CP][0-9]+'
-    match = re.match(pattern, symbol)
+    def __init__(self, max_requests, time_window, burst=1, name=None):
+        self.name = name
+        self.capacity = burst
+        self.rate = max_requests / time_window
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-    if not match:
-        return None, False
+        # 统计：总调用次数、总等待秒数、当前排队数
+        self.total_calls = 0
+        self.total_wait = 0.0
+        self.backlog = 0
 
-    expiry_str = match.group(1)
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-    try:
-        # 解析日期: 假设00-49为2000-2049, 50-99为1950-1999
-        year_str = expiry_str[:2]
-        month = int(expiry_str[2:4])
-        day = int(expiry_str[4:6])
-
-        year_int = int(year_str)
-        if year_int >= 50:
-            year = 1900 + year_int
+    def _reserve(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            # 先预扣令牌再睡眠，保证并发调用排队而不是一起醒来
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            self.total_calls += 1
+            self.total_wait += wait
+            if wait > 0:
+                self.backlog += 1
+        return wait
+
+    def _release(self):
+        with self.lock:
+            self.backlog -= 1
+
+    def acquire(self):
+        """取一个令牌，不够时阻塞等待；返回等待的秒数"""
+        wait = self._reserve()
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._release()
+                metrics.record_span(f"ratelimit.{self.name}", wait)
+        return wait
+
+    async def acquire_async(self):
+        """asyncio 版本的 acquire，等待期间不阻塞事件循环"""
+        wait = self._reserve()
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._release()
+                metrics.record_span(f"ratelimit.{self.name}", wait)
+        return wait
+
+    # 兼容旧的 RateLimiter 接口
+    wait_if_needed = acquire
+
+    def penalize(self, seconds):
+        """服务端返回限流时调用：清空令牌并额外推迟 seconds 秒"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "total_calls": self.total_calls,
+                "total_wait": round(self.total_wait, 3),
+                "backlog": self.backlog,
+            }
+
+
+RateLimiter = TokenBucket
+
+# 各接口族的配额 (次数, 秒)，窗口比官方文档略大留出余量
+RATE_LIMITS = {
+    "futu.history_deal": (10, 35),
+    "futu.fee_query": (10, 35),
+    "futu.cash_flow": (20, 35),
+    "longport.order_detail": (30, 32),
+}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, key=None):
+    """
+    按接口族取共享的限流器，同一进程内所有调用方共用一份配额
+    key 不为空时（例如账户 ID）每个 key 各有一份同样大小的配额
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get((name, key))
+        if limiter is None:
+            max_requests, time_window = RATE_LIMITS[name]
+            label = name if key is None else f"{name}[{key}]"
+            limiter = TokenBucket(max_requests, time_window, name=label)
+            _rate_limiters[(name, key)] = limiter
+        return limiter
+
+
+def rate_limiter_stats():
+    """所有已创建限流器的统计，用于调整窗口参数"""
+    with _rate_limiters_lock:
+        limiters = list(_rate_limiters.values())
+    return [limiter.stats() for limiter in limiters]
+
+
+class LogSink(io.TextIOBase):
+    """
+    线程安全的日志接收端，配合 capture_output 接收一个任务的 print 输出
+    最近 max_lines 行保存在环形缓冲区中供页面显示，完整日志带缓冲地写入按大小轮转的文件；
+    write 只做追加，不触发任何渲染，打印多少都不影响下载速度
+    """
+
+    def __init__(self, max_lines=500, log_file=None, max_bytes=5 * 1024 * 1024, backup_count=3):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.partial = ""
+        self.lock = threading.Lock()
+        self.log_file = Path(log_file) if log_file is not None else None
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        if self.log_file is not None:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.log_file, "a", encoding="utf-8")
+            self.file_size = self.log_file.stat().st_size
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        with self.lock:
+            *done, self.partial = (self.partial + s).split("\n")
+            self.lines.extend(done)
+            if self.file is not None and done:
+                self._write_file(done)
+        return len(s)
+
+    def _write_file(self, lines):
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        chunk = "".join(f"{stamp} {line}\n" for line in lines)
+        size = len(chunk.encode("utf-8"))
+        if self.file_size + size > self.max_bytes and self.file_size > 0:
+            self._rotate()
+        self.file.write(chunk)
+        self.file_size += size
+
+    def _rotate(self):
+        """x.log -> x.log.1 -> ... -> x.log.{backup_count}"""
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.log_file.with_name(f"{self.log_file.name}.{i}")
+            if src.exists():
+                src.replace(self.log_file.with_name(f"{self.log_file.name}.{i + 1}"))
+        if self.backup_count > 0:
+            self.log_file.replace(self.log_file.with_name(f"{self.log_file.name}.1"))
         else:
-            year = 2000 + year_int
+            self.log_file.unlink(missing_ok=True)
+        self.file = open(self.log_file, "w", encoding="utf-8")
+        self.file_size = 0
+
+    def text(self):
+        with self.lock:
+            return "\n".join([*self.lines, self.partial])
 
-        expiry_date = datetime(year, month, day)
-        return expiry_date, True
+    def tail(self, n=20):
+        """最近 n 行"""
+        with self.lock:
+            lines = [*self.lines, self.partial] if self.partial else list(self.lines)
+        return "\n".join(lines[-n:])
 
-    except (ValueError, IndexError):
-        return None, False
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
 
-class StreamlitLogger(io.StringIO):
-    def __init__(self, placeholder, height=300):
-        super().__init__()
-        self.placeholder = placeholder
-        self.height = height
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                if self.partial:
+                    self._write_file([self.partial])
+                self.file.close()
+                self.file = None
+        super().close()
+
+
+_output_sink = contextvars.ContextVar("output_sink", default=None)
+
+
+class _RoutedStdout(io.TextIOBase):
+    """替换 sys.stdout：当前上下文登记了 LogSink 时写入它，否则写原来的 stdout"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def writable(self):
+        return True
 
     def write(self, s):
-        super().write(s)
-        # 每次打印以后刷新
-        self.placeholder.text_area(
-            "执行日志",
-            self.getvalue(),
-            height=self.height,
-            disabled=True,
-        )
+        sink = _output_sink.get()
+        return (sink if sink is not None else self.fallback).write(s)
 
-def run_with_output(fn, *args, **kwargs):
-    placeholder = st.empty()
-    logger = StreamlitLogger(placeholder)
+    def flush(self):
+        sink = _output_sink.get()
+        (sink if sink is not None else self.fallback).flush()
 
-    with contextlib.redirect_stdout(logger):
-        return fn(*args, **kwargs)
 
+_stdout_lock = threading.Lock()
 
 
-def safe_read_csv(path, **kwargs):
+@contextlib.contextmanager
+def capture_output(sink):
     """
-    跨 Windows / Mac / Excel / 券商导出 的安全 CSV 读取
+    把当前线程（及通过 ContextThreadPool 派生的工作线程）的 print 输出写到 sink
+    按上下文区分，多个任务线程可以同时各自捕获，互不串行
     """
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _RoutedStdout):
+            sys.stdout = _RoutedStdout(sys.stdout)
+    token = _output_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _output_sink.reset(token)
+
+
+class ContextThreadPool(ThreadPoolExecutor):
+    """提交任务时带上提交方的 contextvars，工作线程的输出仍归属提交它的任务"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# 各券商缓存文件的读取 schema：只读需要的列，低基数字符串列用 category
+CSV_SCHEMAS = {
+    "futu_trade": {
+        "usecols": ["deal_id", "order_id", "code", "deal_market", "trd_side",
+                    "qty", "price", "create_time", "acc_id", "fee_amount"],
+        "dtype": {"deal_id": str, "order_id": str, "code": "category",
+                  "deal_market": "category", "trd_side": "category",
+                  "qty": "float64", "price": "float64", "fee_amount": "float64"},
+    },
+    "futu_cash": {
+        "dtype": {"currency": "category", "cashflow_type": "category",
+                  "cashflow_direction": "category", "cashflow_amount": "float64"},
+    },
+    "longport_trade": {
+        "usecols": ["order_id", "charge_detail_currency", "charge_detail_total_amount",
+                    "executed_price", "executed_quantity", "symbol", "price", "side",
+                    "quantity", "updated_at"],
+        "dtype": {"order_id": str, "symbol": "category", "side": "category",
+                  "charge_detail_currency": "category", "quantity": "float64",
+                  "executed_quantity": "float64", "price": "float64",
+                  "charge_detail_total_amount": "float64"},
+    },
+    "longport_cash": {
+        "dtype": {"currency": "category", "direction": "category",
+                  "transaction_flow_name": "category", "balance": "float64"},
+    },
+}
+
+SNIFF_BYTES = 64 * 1024
 
-    encodings = [
-        "utf-8-sig",  # 首选：Windows Excel
-        "utf-8",
-        "gbk",
-        "gb18030"
-    ]
 
-    last_error = None
+def sniff_encoding(path, n_bytes=SNIFF_BYTES, full=False):
+    """
+    只读文件开头一段字节判断编码
+    full=True 时按块解码整个文件确认是 utf-8（内存占用与文件大小无关），
+    用于分块读取：中途才出现的 gbk 字节在迭代时才会报错，无法再回退
+    """
+    with open(path, "rb") as f:
+        head = f.read(n_bytes)
+    if head.startswith(b"\xef\xbb\xbf"):
+        encoding = "utf-8-sig"  # Windows Excel
+    else:
+        try:
+            head.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError as e:
+            # 截断处刚好切在多字节字符中间，不算错误
+            if not (e.start >= len(head) - 3 and len(head) == n_bytes):
+                return "gb18030"  # gbk 的超集
+            encoding = "utf-8"
+    if full and len(head) == n_bytes:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    decoder.decode(block)
+                decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "gb18030"
+    return encoding
+
+
+def csv_has_rows(path):
+    """廉价判断 CSV 是否存在且除表头外至少有一行数据"""
+    try:
+        with open(path, "rb") as f:
+            seen_header = False
+            for line in f:
+                if not line.strip(b"\xef\xbb\xbf\r\n\t ,"):
+                    continue
+                if seen_header:
+                    return True
+                seen_header = True
+    except OSError:
+        return False
+    return False
+
+
+def safe_read_csv(path, schema=None, **kwargs):
+    """
+    跨 Windows / Mac / Excel / 券商导出 的安全 CSV 读取
+
+    先根据文件开头的字节判断编码，再用 C 解析器一次读完；
+    schema 为 CSV_SCHEMAS 的键，指定要读取的列和类型
+    """
+    if schema is not None:
+        spec = CSV_SCHEMAS[schema]
+        if "usecols" in spec and "usecols" not in kwargs:
+            wanted = set(spec["usecols"])
+            kwargs["usecols"] = lambda c: c in wanted
+        kwargs["dtype"] = {**spec.get("dtype", {}), **kwargs.get("dtype", {})}
 
-    for enc in encodings:
+    with metrics.span("csv.parse", path=str(path)):
+        encoding = sniff_encoding(path, full="chunksize" in kwargs)
+        options = dict(encoding=encoding, skip_blank_lines=True,
+                       on_bad_lines="skip", **kwargs)  # 防止异常行炸整个文件
         try:
-            df = pd.read_csv(
-                path,
-                encoding=enc,
-                engine="python",        # 关键：跨平台最稳
-                skip_blank_lines=True,
-                on_bad_lines="skip",    # 防止异常行炸整个文件
-                **kwargs
-            )
-            print(f"CSV loaded with encoding: {enc}")
-            return df
-
-        except Exception as e:
-            last_error = e
-
-    raise RuntimeError(f"无法读取 CSV: {path}\n{last_error}")
\ No newline at end of file
+            df = pd.read_csv(path, engine="c", **options)
+        except UnicodeDecodeError:
+            # 开头是 utf-8、后面混入了 gbk 的文件
+            options["encoding"] = encoding = "gb18030"
+            df = pd.read_csv(path, engine="c", **options)
+        except (pd.errors.ParserError, ValueError) as e:
+            # C 解析器处理不了的极端格式，退回 python 解析器
+            try:
+                df = pd.read_csv(path, engine="python", **options)
+            except Exception:
+                raise RuntimeError(f"无法读取 CSV: {path}\n{e}")
+    if isinstance(df, pd.DataFrame):
+        metrics.incr("rows.csv", len(df))
+    print(f"CSV loaded with encoding: {encoding}")
+    return df
@@ -0,0 +1,137 @@
+"""
+下载吞吐基准：用 api.fake_broker 模拟长桥 / 富途接口，测量各下载流程的请求数、行数和耗时
+
+time_scale 同时缩放替身的限频窗口和客户端限流器，配额次数不变，
+因此结果反映的是限频调度本身的效率，按比例换算即可估计真实接口下的耗时。
+
+用法:
+    python -m benchmarks.fetch --fills 5000 --save      # 生成基线
+    python -m benchmarks.fetch --fills 5000             # 与基线对比
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from .generate import generate
+
+BASELINE = Path(__file__).with_name("fetch_baseline.json")
+START = datetime(2022, 1, 1)
+
+
+def _rows(path):
+    from api.utils import safe_read_csv
+    path = Path(path)
+    return len(safe_read_csv(path)) if path.exists() and path.stat().st_size else 0
+
+
+def cases(out_dir, end, cash_end):
+    from api import user_futu, user_longport
+
+    def longport_trade():
+        ctx = user_longport.get_ctx()
+        user_longport.get_trade_flow(out_dir / "longbridge_trade.csv", ctx, START, end,
+                                     incremental=False)
+        return out_dir / "longbridge_trade.csv"
+
+    def longport_cash():
+        ctx = user_longport.get_ctx()
+        user_longport.get_cash_flow(out_dir / "longbridge_cash.csv", ctx, START, end)
+        return out_dir / "longbridge_cash.csv"
+
+    def futu_trade():
+        user_futu.get_trade_flow(out_dir / "futu_trade.csv", START, end)
+        return out_dir / "futu_trade.csv"
+
+    def futu_cash():
+        user_futu.get_cash_flow(out_dir / "futu_cash.csv", START, cash_end)
+        return out_dir / "futu_cash.csv"
+
+    return {
+        "longport_trade": longport_trade,
+        "longport_cash": longport_cash,
+        "futu_trade": futu_trade,
+        "futu_cash": futu_cash,
+    }
+
+
+def run(fills, data_dir, latency, time_scale, cash_days, only=None):
+    from api import fake_broker
+
+    data_dir = Path(data_dir)
+    generate(data_dir / "source" / str(fills), fills)
+    broker = fake_broker.install(fake_broker.FakeBroker(
+        data_dir / "source" / str(fills), latency=latency, time_scale=time_scale))
+    out_dir = data_dir / "fetched" / str(fills)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    end = START + timedelta(days=4 * 365)
+    results = {}
+    for name, fn in cases(out_dir, end, START + timedelta(days=cash_days)).items():
+        if only and name not in only:
+            continue
+        calls_before, rejected_before = dict(broker.calls), broker.rejected()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            path = fn()
+        wall = time.perf_counter() - started
+        calls = sum(broker.calls.values()) - sum(calls_before.values())
+        rejected = sum(broker.rejected().values()) - sum(rejected_before.values())
+        rows = _rows(path)
+        results[f"{name}@{fills}"] = {"wall_s": round(wall, 4), "calls": calls,
+                                      "rows": rows, "rejected": rejected}
+        print(f"{name:16s} {fills:>8d}  {wall:9.3f}s  {calls:7d} calls  {calls / wall:8.1f} calls/s  "
+              f"{rows:8d} rows  {rows / wall:10.1f} rows/s  {rejected:4d} rejected")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载流程吞吐基准（本地券商替身）")
+    parser.add_argument("--fills", type=int, default=2_000)
+    parser.add_argument("--data-dir", default=".bench_data/fetch")
+    parser.add_argument("--latency", type=float, default=0.005, help="单次调用的平均延迟（秒）")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="限频窗口的缩放比例")
+    parser.add_argument("--cash-days", type=int, default=120, help="富途现金流水查询的天数")
+    parser.add_argument("--only", nargs="*", help="只运行指定的基准")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基线")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="超过基线的倍数视为退化")
+    args = parser.parse_args()
+
+    results = run(args.fills, args.data_dir, args.latency, args.time_scale,
+                  args.cash_days, args.only)
+    baseline_path = Path(args.baseline)
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "latency": args.latency,
+            "time_scale": args.time_scale,
+            "results": results,
+        }
+        baseline_path.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+        print(f"基线已保存到 {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print("没有基线文件，使用 --save 生成")
+        return
+    baseline = json.loads(baseline_path.read_text())["results"]
+    regressions = [(key, baseline[key]["wall_s"], cur["wall_s"]) for key, cur in results.items()
+                   if key in baseline and cur["wall_s"] / baseline[key]["wall_s"] > args.threshold]
+    for key, base, cur in regressions:
+        print(f"退化: {key} wall_s {base} -> {cur} ({cur / base:.2f}x)")
+    if regressions:
+        sys.exit(1)
+    print("未发现退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+合成交易 / 现金流水生成器，生成与富途、长桥缓存文件同结构的 CSV
+
+用法: python -m benchmarks.generate --fills 100000 --out .bench_data
+"""
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+UNDERLYINGS = {
+    "US": ["AAPL", "TSLA", "NVDA", "MSFT", "AMZN", "META", "QQQ", "SPY"],
+    "HK": ["TCH", "ALB", "MIU", "HEX", "XBI"],
+}
+LONGPORT_UNDERLYINGS = {
+    "US": ["AAPL", "TSLA", "NVDA", "MSFT", "AMZN", "META", "QQQ", "SPY"],
+    "HK": ["700", "9988", "3690", "388", "1810"],
+}
+CURRENCY = {"US": "USD", "HK": "HKD"}
+CHUNK_SIZE = 1_000_000
+
+
+def _option_codes(rng, roots, n):
+    """生成 api.symbols 能识别的期权代码: 标的 + yymmdd + C/P + 行权价"""
+    root = rng.choice(roots, n)
+    year = rng.integers(20, 26, n)
+    month = rng.integers(1, 13, n)
+    day = rng.integers(1, 29, n)
+    cp = rng.choice(["C", "P"], n)
+    strike = rng.integers(50, 500, n) * 1000
+    expiry = pd.Series(year).map("{:02d}".format) + pd.Series(month).map("{:02d}".format) \
+        + pd.Series(day).map("{:02d}".format)
+    return pd.Series(root) + expiry + pd.Series(cp) + pd.Series(strike).astype(str)
+
+
+def universe(rng, roots, option_ratio=0.7, n_symbols=5000):
+    """生成一个有限的 symbol 集合，前面是正股，后面是期权"""
+    n_options = int(n_symbols * option_ratio)
+    options = _option_codes(rng, roots, n_options).unique().tolist()
+    return np.array(list(roots) + options, dtype=object)
+
+
+def _sample(rng, symbols, n):
+    """按 Zipf 分布抽样，模拟少数标的被频繁交易"""
+    weights = 1.0 / np.arange(1, len(symbols) + 1)
+    weights /= weights.sum()
+    return symbols[rng.choice(len(symbols), n, p=weights)]
+
+
+def _times(rng, start, n):
+    seconds = np.sort(rng.integers(0, 3 * 365 * 24 * 3600, n))
+    return pd.Timestamp(start) + pd.to_timedelta(seconds, unit="s")
+
+
+def _quantity(rng, symbols):
+    # 期权按张，正股按 100 股一手
+    is_option = pd.Series(symbols).str.contains(r"[0-9]{6}[CP][0-9]+", regex=True).to_numpy()
+    return rng.integers(1, 20, len(symbols)) * np.where(is_option, 1, 100)
+
+
+def futu_trades(rng, n, universes, short_ratio=0.2, combo_ratio=0.1,
+                start="2022-01-01", id_offset=0):
+    market = rng.choice(["US", "HK"], n, p=[0.7, 0.3])
+    code = np.empty(n, dtype=object)
+    for m in ("US", "HK"):
+        mask = market == m
+        code[mask] = m + "." + _sample(rng, universes[m], mask.sum())
+    # 做空比例越高，卖出方向越多
+    sell = rng.random(n) < 0.5 + short_ratio / 2
+    order_id = np.arange(id_offset, id_offset + n)
+    # 组合单：若干成交共享同一个 order_id
+    combo = rng.random(n) < combo_ratio
+    order_id[1:][combo[1:]] = order_id[:-1][combo[1:]]
+    # 同一订单的成交属于同一个账户
+    acc_id = rng.choice([281756455000000, 281756455000001], n)
+    acc_id[1:][combo[1:]] = acc_id[:-1][combo[1:]]
+    return pd.DataFrame({
+        "deal_id": np.arange(id_offset, id_offset + n),
+        "order_id": order_id,
+        "code": code,
+        "stock_name": code,
+        "deal_market": market,
+        "trd_side": np.where(sell, "SELL", "BUY"),
+        "qty": _quantity(rng, code),
+        "price": np.round(rng.uniform(0.5, 500, n), 2),
+        "create_time": _times(rng, start, n).strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "acc_id": acc_id,
+        "fee_amount": np.round(rng.uniform(0.5, 20, n), 2),
+    })
+
+
+def longport_trades(rng, n, universes, short_ratio=0.2, start="2022-01-01", id_offset=0):
+    market = rng.choice(["US", "HK"], n, p=[0.7, 0.3])
+    symbol = np.empty(n, dtype=object)
+    for m in ("US", "HK"):
+        mask = market == m
+        symbol[mask] = _sample(rng, universes[m], mask.sum()) + "." + m
+    sell = rng.random(n) < 0.5 + short_ratio / 2
+    price = np.round(rng.uniform(0.5, 500, n), 2)
+    quantity = _quantity(rng, symbol)
+    return pd.DataFrame({
+        "order_id": (np.arange(id_offset, id_offset + n) + 700000000000000000).astype(str),
+        "symbol": symbol,
+        "side": np.where(sell, "OrderSide.Sell", "OrderSide.Buy"),
+        "price": price,
+        "quantity": quantity,
+        "executed_price": price,
+        "executed_quantity": quantity,
+        "charge_detail_currency": pd.Series(market).map(CURRENCY).to_numpy(),
+        "charge_detail_total_amount": np.round(rng.uniform(0.5, 20, n), 2),
+        "updated_at": _times(rng, start, n).strftime("%Y-%m-%d %H:%M:%S.%f"),
+    })
+
+
+def futu_cash(rng, n, start="2022-01-01"):
+    remarks = np.array(["ADR FEE", "STAMP DUTY", "INTEREST", "DIVIDENDS AAPL",
+                        "WITHHOLDING TAX", "PLATFORM FEE", "DEPOSIT", "TRANSFER"])
+    return pd.DataFrame({
+        "cashflow_id": np.arange(n),
+        "clearing_date": _times(rng, start, n).strftime("%Y-%m-%d"),
+        "settlement_date": _times(rng, start, n).strftime("%Y-%m-%d"),
+        "currency": rng.choice(["USD", "HKD"], n),
+        "cashflow_type": "OTHER",
+        "cashflow_direction": "OUT",
+        "cashflow_amount": -np.round(rng.uniform(0.1, 50, n), 2),
+        "cashflow_remark": rng.choice(remarks, n),
+        "acc_id": 281756455000000,
+    })
+
+
+def longport_cash(rng, n, symbols, start="2022-01-01"):
+    symbol = rng.choice(symbols, n)
+    adr = rng.random(n) < 0.3
+    # 一部分 ADR 费用不带 symbol 字段，只能从描述里解析
+    no_symbol = adr & (rng.random(n) < 0.5)
+    return pd.DataFrame({
+        "balance": -np.round(rng.uniform(0.1, 50, n), 2),
+        "business_time": _times(rng, start, n).strftime("%Y-%m-%d %H:%M:%S"),
+        "business_type": 1,
+        "currency": "USD",
+        "description": pd.Series(symbol) + " ADR Fee",
+        "direction": "OUT",
+        "symbol": np.where(no_symbol, "", symbol),
+        "transaction_flow_name": np.where(adr, "ADR Fee", "Other"),
+    })
+
+
+def _write_chunked(path, make, n, chunk_size=CHUNK_SIZE):
+    """分块生成并追加写入，10M 级别的数据也不会一次性占满内存"""
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    written = 0
+    for i, offset in enumerate(range(0, n, chunk_size)):
+        size = min(chunk_size, n - offset)
+        # 每个块的时间向后平移，保证整体按时间有序
+        df = make(size, offset, i)
+        df.to_csv(path, index=False, encoding="utf-8-sig" if i == 0 else "utf-8",
+                  mode="w" if i == 0 else "a", header=i == 0)
+        written += size
+    return written
+
+
+def generate(out_dir, fills, cash_rows=None, seed=0, option_ratio=0.7, short_ratio=0.2,
+             combo_ratio=0.1, n_symbols=5000):
+    """生成四个 CSV，返回 {名称: 路径}"""
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    cash_rows = cash_rows if cash_rows is not None else max(1000, fills // 10)
+    # 按块平移时间，3 年一块
+    shift = lambda i: (pd.Timestamp("2022-01-01") + pd.DateOffset(years=3 * i)).strftime("%Y-%m-%d")
+
+    paths = {
+        "futu_trade": out_dir / "futu_trade.csv",
+        "futu_cash": out_dir / "futu_cash.csv",
+        "longport_trade": out_dir / "longbridge_trade.csv",
+        "longport_cash": out_dir / "longbridge_cash.csv",
+    }
+    futu_universes = {m: universe(rng, r, option_ratio, n_symbols) for m, r in UNDERLYINGS.items()}
+    longport_universes = {m: universe(rng, r, option_ratio, n_symbols)
+                          for m, r in LONGPORT_UNDERLYINGS.items()}
+    _write_chunked(paths["futu_trade"], lambda n, off, i: futu_trades(
+        rng, n, futu_universes, short_ratio, combo_ratio, shift(i), off), fills)
+    _write_chunked(paths["longport_trade"], lambda n, off, i: longport_trades(
+        rng, n, longport_universes, short_ratio, shift(i), off), fills)
+    _write_chunked(paths["futu_cash"], lambda n, off, i: futu_cash(rng, n, shift(i)), cash_rows)
+    symbols = np.array([f"{s}.US" for s in LONGPORT_UNDERLYINGS["US"]], dtype=object)
+    _write_chunked(paths["longport_cash"], lambda n, off, i: longport_cash(
+        rng, n, symbols, shift(i)), cash_rows)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成的券商交易 / 现金流水 CSV")
+    parser.add_argument("--fills", type=int, default=10_000)
+    parser.add_argument("--cash-rows", type=int, default=None)
+    parser.add_argument("--out", default=".bench_data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--option-ratio", type=float, default=0.7)
+    parser.add_argument("--short-ratio", type=float, default=0.2)
+    parser.add_argument("--combo-ratio", type=float, default=0.1)
+    parser.add_argument("--symbols", type=int, default=5000)
+    args = parser.parse_args()
+    paths = generate(args.out, args.fills, args.cash_rows, args.seed, args.option_ratio,
+                     args.short_ratio, args.combo_ratio, args.symbols)
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
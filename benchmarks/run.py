@@ -0,0 +1,126 @@
+"""
+性能基准：计时各解析 / 计算阶段，记录耗时和峰值内存，并与 JSON 基线对比
+
+用法:
+    python -m benchmarks.run --sizes 10000 100000 --save      # 生成基线
+    python -m benchmarks.run --sizes 10000 100000             # 与基线对比
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from .generate import generate
+
+BASELINE = Path(__file__).with_name("baseline.json")
+
+
+def measure(fn, *args, **kwargs):
+    """返回 (秒, 峰值内存 MiB)；被测函数的 print 输出被丢弃"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn(*args, **kwargs)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(elapsed, 4), round(peak / 1024 / 1024, 2)
+
+
+def cases(paths):
+    from api.utils import safe_read_csv
+    from api.user_futu import remove_repeated_fee, extract_other_fees, format_trade
+    from api.user_longport import load_longport_adr_events, format_longport_trade
+
+    futu_trades = safe_read_csv(paths["futu_trade"])
+    return {
+        "safe_read_csv": (safe_read_csv, (paths["futu_trade"],), {}),
+        # remove_repeated_fee 原地排序，每次给一份拷贝
+        "remove_repeated_fee": (lambda: remove_repeated_fee(futu_trades.copy()), (), {}),
+        "extract_other_fees": (extract_other_fees, (paths["futu_cash"],), {}),
+        "load_longport_adr_events": (load_longport_adr_events, (paths["longport_cash"],), {}),
+        "format_trade": (format_trade, (paths["futu_trade"], paths["futu_cash"]), {}),
+        "format_longport_trade": (format_longport_trade,
+                                  (paths["longport_trade"], paths["longport_cash"]), {}),
+        "format_trade_streaming": (format_trade, (paths["futu_trade"], paths["futu_cash"]),
+                                   {"chunksize": 200_000}),
+        "format_longport_trade_streaming": (format_longport_trade,
+                                            (paths["longport_trade"], paths["longport_cash"]),
+                                            {"chunksize": 200_000}),
+    }
+
+
+def run(sizes, data_dir, repeat=1, only=None):
+    results = {}
+    for size in sizes:
+        paths = generate(Path(data_dir) / str(size), size)
+        for name, (fn, args, kwargs) in cases(paths).items():
+            if only and name not in only:
+                continue
+            runs = [measure(fn, *args, **kwargs) for _ in range(repeat)]
+            wall = min(r[0] for r in runs)
+            peak = max(r[1] for r in runs)
+            results[f"{name}@{size}"] = {"wall_s": wall, "peak_mib": peak}
+            print(f"{name:28s} {size:>10d}  {wall:10.4f}s  {peak:10.2f} MiB")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """返回退化的条目列表"""
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ("wall_s", "peak_mib"):
+            if base[metric] > 0 and cur[metric] / base[metric] > threshold:
+                regressions.append((key, metric, base[metric], cur[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析 / 计算阶段性能基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--data-dir", default=".bench_data")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="只运行指定的基准")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基线")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="超过基线的倍数视为退化")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.data_dir, args.repeat, args.only)
+    baseline_path = Path(args.baseline)
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        baseline_path.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+        print(f"基线已保存到 {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print("没有基线文件，使用 --save 生成")
+        return
+    baseline = json.loads(baseline_path.read_text())["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for key, metric, base, cur in regressions:
+        print(f"退化: {key} {metric} {base} -> {cur} ({cur / base:.2f}x)")
+    if regressions:
+        sys.exit(1)
+    print("未发现退化")
+
+
+if __name__ == "__main__":
+    main()
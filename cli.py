@@ -0,0 +1,240 @@
+"""
+命令行入口，不依赖 Streamlit，可用于 cron 定时任务
+
+    python cli.py fetch longport --start 2024-01-01
+    python cli.py fetch futu --start 2024-01-01 --end 2024-12-31
+    python cli.py compute --method fifo
+    python cli.py report --out reports
+    python cli.py batch tenants.yaml --workers 4
+
+券商 SDK 只在 fetch 时才导入，compute / report 只需要 pandas
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+CONFIG_PATH = "config.yaml"
+BROKERS = ("longport", "futu")
+
+
+def load_config(path=CONFIG_PATH):
+    import yaml
+
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def cmd_fetch(args, config):
+    brokers = BROKERS if args.broker == "all" else (args.broker,)
+    for broker in brokers:
+        files = config[broker]
+        if broker == "longport":
+            from dotenv import load_dotenv
+            from api import user_longport
+
+            load_dotenv(".env")
+            ctx = user_longport.get_ctx()
+            print("正在下载长桥交易流水")
+            user_longport.get_trade_flow(files["trade_file"], ctx, args.start, args.end)
+            print("正在下载长桥现金流水")
+            user_longport.get_cash_flow(files["cash_file"], ctx, args.start, args.end)
+        else:
+            from api import user_futu
+
+            print("正在下载富途交易流水")
+            user_futu.get_trade_flow(files["trade_file"], args.start, args.end, replace=args.replace)
+            print("正在下载富途现金流水")
+            user_futu.get_cash_flow(files["cash_file"], args.start, args.end,
+                                    holiday_file=files.get("holiday_file"))
+    print("下载完成")
+
+
+def compute(config, brokers=BROKERS, method="average", chunksize=None, use_cache=True):
+    """返回 {broker: pool}，只计算缓存文件存在且有数据的券商"""
+    from api.utils import csv_has_rows
+    from api.result_cache import cached_call
+
+    def call(fn, *args, **kwargs):
+        return cached_call(fn, *args, **kwargs) if use_cache else fn(*args, **kwargs)
+
+    multipliers = (config.get("symbols") or {}).get("multipliers")
+    pools = {}
+    if "longport" in brokers:
+        files = config["longport"]
+        if csv_has_rows(files["trade_file"]) and csv_has_rows(files["cash_file"]):
+            from api import user_longport
+
+            pools["longport"] = call(user_longport.format_longport_trade,
+                                     files["trade_file"], files["cash_file"],
+                                     chunksize=chunksize, method=method,
+                                     checkpoint_dir=config.get("checkpoint_dir"),
+                                     multipliers=multipliers)
+    if "futu" in brokers:
+        files = config["futu"]
+        if csv_has_rows(files["trade_file"]):
+            from api import user_futu
+
+            cash_file = files["cash_file"] if csv_has_rows(files["cash_file"]) else None
+            if cash_file is None:
+                print("富途现金流水不存在，计算结果可能不准确", file=sys.stderr)
+            today = datetime.combine(datetime.today().date(), datetime.min.time())
+            pools["futu"] = call(user_futu.format_trade, files["trade_file"], cash_file,
+                                 check_date=today, chunksize=chunksize, method=method,
+                                 checkpoint_dir=config.get("checkpoint_dir"),
+                                 multipliers=multipliers)
+    return pools
+
+
+def base_totals(config, pools):
+    """
+    按 config.yaml 的 fx 配置把每年收益折算成本位币
+    返回 (base, {broker: DataFrame})，没有配置汇率文件时为 (None, {})
+    """
+    fx_config = config.get("fx") or {}
+    rate_file = fx_config.get("rate_file")
+    if not rate_file or not Path(rate_file).exists():
+        return None, {}
+    import pandas as pd
+    from api import fx
+
+    base = fx_config.get("base", fx.DEFAULT_BASE)
+    rates = fx.load_rates(rate_file)
+    events = {broker: pool.events for broker, pool in pools.items() if hasattr(pool, "events")}
+    if len(events) == 2:
+        events["combined"] = pd.concat(list(events.values()), ignore_index=True)
+    return base, {broker: fx.yearly_totals(e, rates, base) for broker, e in events.items()}
+
+
+def _brokers(args):
+    return BROKERS if args.broker == "all" else (args.broker,)
+
+
+def cmd_compute(args, config):
+    from api.report import yearly_tables
+
+    pools = compute(config, _brokers(args), args.method, args.chunksize, not args.no_cache)
+    if not pools:
+        print("未检测到可用的数据文件或文件为空，请先下载。")
+        return 1
+    for broker, pool in pools.items():
+        for currency, df in yearly_tables(pool).items():
+            print(f"\n== {broker} — {currency} ==")
+            print(df.loc[[f"{currency} Total"]].to_string(float_format="{:.2f}".format))
+    base, tables = base_totals(config, pools)
+    for broker, df in tables.items():
+        print(f"\n== {broker} — 折合 {base} ==")
+        print(df.to_string(float_format="{:.2f}".format))
+
+
+def write_reports(config, pools, out):
+    """把每个券商（以及合并）的每年明细和本位币合计导出为 CSV，返回导出的文件列表"""
+    from api.report import combine, yearly_tables
+
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    paths = []
+    base, tables = base_totals(config, pools)
+    for broker, df in tables.items():
+        path = out / f"{broker}_{base}.csv"
+        df.round(2).to_csv(path, encoding="utf-8-sig")
+        paths.append(path)
+    pools = dict(pools)
+    if len(pools) == 2:
+        pools["combined"] = combine(pools["longport"], pools["futu"])
+    for broker, pool in pools.items():
+        for currency, df in yearly_tables(pool).items():
+            path = out / f"{broker}_{currency}.csv"
+            df.round(2).to_csv(path, encoding="utf-8-sig")
+            paths.append(path)
+    for path in paths:
+        print(f"已导出 {path}")
+    return [str(p) for p in paths]
+
+
+def cmd_report(args, config):
+    pools = compute(config, _brokers(args), args.method, args.chunksize, not args.no_cache)
+    if not pools:
+        print("未检测到可用的数据文件或文件为空，请先下载。")
+        return 1
+    write_reports(config, pools, args.out)
+
+
+def tenant_report(tenant):
+    """批量模式下在租户子进程中执行，当前目录已切换到租户目录"""
+    config = load_config(tenant["config"])
+    brokers = tenant.get("brokers") or BROKERS
+    pools = compute(config, brokers, tenant.get("method", "average"), tenant.get("chunksize"),
+                    not tenant.get("no_cache", False))
+    if not pools:
+        raise FileNotFoundError("未检测到可用的数据文件或文件为空")
+    return write_reports(config, pools, tenant["out"])
+
+
+def cmd_batch(args, config):
+    from api.batch import load_manifest, run_batch
+
+    tenants, max_workers = load_manifest(args.manifest)
+    if args.only:
+        tenants = [t for t in tenants if t["name"] in args.only]
+    max_workers = args.workers or max_workers
+    print(f"共 {len(tenants)} 个租户，最多 {max_workers} 个并行")
+
+    def on_done(result):
+        status = "完成" if result["state"] == "done" else f"失败 {result['message']}"
+        peak = f"，峰值 {result['peak_mib']} MiB" if result["peak_mib"] is not None else ""
+        print(f"[{result['name']}] {status}（{result['seconds']}s{peak}），日志 {result['log']}")
+
+    results = run_batch(tenants, tenant_report, max_workers, on_done=on_done)
+    failed = [r["name"] for r in results if r["state"] != "done"]
+    print(f"完成 {len(results) - len(failed)} 个，失败 {len(failed)} 个" +
+          (f": {', '.join(failed)}" if failed else ""))
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="股票年度已实现盈利计算器（命令行）")
+    parser.add_argument("--config", default=CONFIG_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fetch = sub.add_parser("fetch", help="从券商下载交易和现金流水")
+    fetch.add_argument("broker", choices=BROKERS + ("all",))
+    fetch.add_argument("--start", type=parse_date, required=True)
+    fetch.add_argument("--end", type=parse_date,
+                       default=datetime.combine(datetime.today().date(), datetime.min.time()))
+    fetch.add_argument("--replace", action="store_true",
+                       help="用本次下载的富途成交覆盖缓存（默认只追加缓存中没有的成交）")
+    fetch.set_defaults(func=cmd_fetch)
+
+    for name, func, help_text in (("compute", cmd_compute, "计算并打印每年合计"),
+                                  ("report", cmd_report, "计算并导出每年明细 CSV")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--broker", choices=BROKERS + ("all",), default="all")
+        p.add_argument("--method", choices=("average", "fifo"), default="average")
+        p.add_argument("--chunksize", type=int, default=None, help="流式处理的分块行数")
+        p.add_argument("--no-cache", action="store_true", help="不使用结果缓存")
+        if name == "report":
+            p.add_argument("--out", default="reports")
+        p.set_defaults(func=func)
+
+    batch = sub.add_parser("batch", help="按租户清单批量计算并导出报表（每个租户独立进程）")
+    batch.add_argument("manifest", help="租户清单 YAML")
+    batch.add_argument("--workers", type=int, default=None, help="并行进程数，默认取清单配置")
+    batch.add_argument("--only", nargs="*", help="只计算指定的租户")
+    batch.set_defaults(func=cmd_batch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # 批量模式每个租户读自己的 config.yaml
+    config = None if args.command == "batch" else load_config(args.config)
+    return args.func(args, config) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
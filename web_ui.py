@@ -5,69 +5,89 @@ from datetime import datetime
 from dotenv import load_dotenv, set_key
 import os
 from api import user_futu, user_longport
-from api.utils import run_with_output,safe_read_csv
+from api.utils import csv_has_rows
+from api.jobs import JobRunner, ACTIVE_STATES, RESUMABLE_STATES
+from api.result_cache import cached_call
+from api.report import combine, long_table, page_table, split_total, symbol_events, yearly_tables
+from api import fx
+from api import metrics
 import yaml
 
 CONFIG_FILE = Path(".env")
 if CONFIG_FILE.exists():
     load_dotenv(CONFIG_FILE)
 
-with open("config.yaml", "r", encoding="utf-8") as f:
-    config = yaml.safe_load(f)
+
+CONFIG_PATH = "config.yaml"
+
+
+@st.cache_resource
+def load_config(path, mtime):
+    # mtime 只用作缓存键：config.yaml 修改后下一次运行会重新读取
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+config = load_config(CONFIG_PATH, os.path.getmtime(CONFIG_PATH))
+
+
+@st.cache_resource
+def get_job_runner():
+    # 整个进程共用一个任务执行器，页面刷新或断开连接不会影响正在进行的下载
+    return JobRunner()
+
+
+job_runner = get_job_runner()
 
 # -----------------------
 # 收益展示函数
 # -----------------------
 
 
-def show_yearly_bonus_by_currency(stocks, title):
-    if isinstance(stocks, dict):
-        stocks = list(stocks.values())
-    from collections import defaultdict
-    currency_groups = defaultdict(list)
-    for s in stocks:
-        currency_groups[s.currency].append(s)
+PAGE_SIZE = 50
 
-    for currency, group in currency_groups.items():
-        st.subheader(f"{title} — {currency}")
 
-        all_years = sorted({y for s in group for y in s.bonus_by_year.keys()})
-        rows = []
-        for s in group:
-            row = {"Symbol": s.symbol}
-            total = 0.0
-            for y in all_years:
-                v = s.bonus_by_year.get(y, 0.0)
-                row[str(y)] = v
-                total += v
-            row["Total"] = total
-            rows.append(row)
-        df = pd.DataFrame(rows).set_index("Symbol")
-
-        sum_row = {"Symbol": f"{currency} Total"}
-        for y in all_years:
-            sum_row[str(y)] = df[str(y)].sum()
-        sum_row["Total"] = df["Total"].sum()
-        df = pd.concat([df, pd.DataFrame([sum_row]).set_index("Symbol")])
-
-        numeric_cols = df.select_dtypes(include="number").columns
-        max_abs = df[numeric_cols].abs().max().max() or 1
-
-        def color_by_value(val):
-            if pd.isna(val):
-                return ""
-            norm = min(abs(val) / max_abs, 1.0)
-            if val > 0:
-                green = int(50 + 205 * norm)
-                return f"color: rgb(0,{green},0)"
-            elif val < 0:
-                red = int(50 + 205 * norm)
-                return f"color: rgb({red},0,0)"
-            return "color: gray"
-
-        styled = df.style.format("{:.2f}").applymap(
-            color_by_value, subset=numeric_cols)
-        st.dataframe(styled, use_container_width=True)
+def show_yearly_bonus_by_currency(tables, source, title, key):
+    """
+    tables 为 yearly_tables 的结果；明细在服务端过滤、排序、分页后只渲染当前页，
+    单个标的的每日明细在选中时才加载
+    """
+    for currency, df in tables.items():
+        st.subheader(f"{title} — {currency}")
+        detail, total = split_total(df)
+        number_format = {c: st.column_config.NumberColumn(format="%.2f") for c in df.columns}
+        st.dataframe(total, column_config=number_format, use_container_width=True)
+
+        prefix = f"{key}-{currency}"
+        col_query, col_sort, col_order, col_page = st.columns([3, 2, 1, 1])
+        query = col_query.text_input("筛选代码", key=f"{prefix}-query")
+        sort_by = col_sort.selectbox(
+            "排序", ["Total", "Symbol"] + [c for c in detail.columns if c != "Total"],
+            key=f"{prefix}-sort")
+        ascending = col_order.checkbox("升序", key=f"{prefix}-asc")
+        page = col_page.number_input("页码", min_value=1, step=1, key=f"{prefix}-page")
+
+        view, rows = page_table(detail, query, sort_by, ascending, int(page), PAGE_SIZE)
+        st.dataframe(view, column_config=number_format, use_container_width=True)
+        st.caption(f"共 {rows} 个标的，每页 {PAGE_SIZE} 个")
+
+        symbol = st.selectbox("查看标的每日收益", [""] + view.index.tolist(), key=f"{prefix}-detail")
+        if symbol:
+            st.caption(f"{symbol} 每天的已实现收益合计")
+            st.dataframe(symbol_events(source, symbol), use_container_width=True)
+
+
+def show_base_currency_totals(events, title):
+    """按 config.yaml 的 fx 配置显示每年折合本位币的合计"""
+    fx_config = config.get("fx") or {}
+    rate_file = fx_config.get("rate_file")
+    if events is None or not rate_file or not Path(rate_file).exists():
+        return
+    base = fx_config.get("base", fx.DEFAULT_BASE)
+    table = fx.yearly_totals(events, fx.load_rates(rate_file), base)
+    st.subheader(f"{title} — 折合 {base}")
+    st.dataframe(table, column_config={c: st.column_config.NumberColumn(format="%.2f")
+                                       for c in table.columns}, use_container_width=True)
 
 
 # -----------------------
@@ -121,46 +141,84 @@ futu_end = st.sidebar.date_input(
     "结束日期", value=today, max_value=today, key="futu_end")
 futu_end = datetime.combine(futu_end, datetime.min.time())
 download_btn_futu = st.sidebar.button("⬇️ 开始下载富途数据")
+cost_method = st.sidebar.selectbox(
+    "成本计算方法", ["average", "fifo"],
+    format_func=lambda m: {"average": "移动平均", "fifo": "先进先出 (FIFO)"}[m])
 compute_btn = st.sidebar.button("🚀 开始计算")
 
 # -------- 下载操作 --------
+# 下载在后台任务中进行，长桥和富途可以同时下载
 if download_btn_longport:
-    st.info("正在下载长桥交易流水")
-    run_with_output(user_longport.get_trade_flow, ".cache_data/longbridge_trade.csv",
-                    user_longport.get_ctx(), longport_start, longport_end)
-    st.info("正在下载长桥现金流水")
-    run_with_output(user_longport.get_cash_flow, ".cache_data/longbridge_cash.csv",
-                    user_longport.get_ctx(), longport_start, longport_end)
-    st.info("下载完成 ✅")
+    job_runner.submit("longport", {
+        "start": longport_start.isoformat(), "end": longport_end.isoformat(),
+        "trade_file": config["longport"]["trade_file"],
+        "cash_file": config["longport"]["cash_file"],
+    })
 if download_btn_futu:
-    st.info("正在下载富途交易流水")
-    run_with_output(user_futu.get_trade_flow,
-                    ".cache_data/futu_trade.csv", futu_start, futu_end)
-    st.info("正在下载富途现金流水")
-    run_with_output(user_futu.get_cash_flow,
-                    ".cache_data/futu_cash.csv", futu_start, futu_end)
-    st.info("下载完成 ✅")
+    job_runner.submit("futu", {
+        "start": futu_start.isoformat(), "end": futu_end.isoformat(),
+        "trade_file": config["futu"]["trade_file"],
+        "cash_file": config["futu"]["cash_file"],
+        "holiday_file": config["futu"].get("holiday_file"),
+    })
+
+JOB_NAMES = {"longport": "长桥", "futu": "富途"}
+STEP_NAMES = {"trade": "交易流水", "cash": "现金流水"}
+
+
+@st.fragment(run_every=1)
+def show_jobs():
+    """下载任务列表，每秒刷新一次进度"""
+    jobs = job_runner.list(limit=6)
+    if not jobs:
+        return
+    st.subheader("下载任务")
+    for job in jobs:
+        name = JOB_NAMES.get(job["kind"], job["kind"])
+        step = STEP_NAMES.get(job["step"], job["step"] or "")
+        label = f"{name} {step} · {job['state']} · {job['params']['start'][:10]} ~ " \
+                f"{job['params']['end'][:10]} {job['message'] or ''}"
+        col_bar, col_btn = st.columns([5, 1])
+        fraction = job["done"] / job["total"] if job["total"] else (1.0 if job["state"] == "done" else 0.0)
+        col_bar.progress(min(fraction, 1.0), text=label)
+        if job["state"] in ACTIVE_STATES:
+            if col_btn.button("取消", key=f"cancel-{job['id']}"):
+                job_runner.cancel(job["id"])
+        elif job["state"] in RESUMABLE_STATES:
+            if col_btn.button("继续", key=f"resume-{job['id']}"):
+                job_runner.resume(job["id"])
+        log = job_runner.log_tail(job["id"])
+        if log:
+            with st.expander("执行日志", expanded=job["state"] in ACTIVE_STATES):
+                st.code(log, language=None)
+
+
+show_jobs()
 
 if compute_btn:
     longport_trade_file = config["longport"]["trade_file"]
     longport_cash_file = config["longport"]["cash_file"]
     futu_trade_file = config["futu"]["trade_file"]
     futu_cash_file = config["futu"]["cash_file"]
+    multipliers = (config.get("symbols") or {}).get("multipliers")
 
     tabs = []
 
-    # Helper: 文件存在且行数 > 0
+    # Helper: 文件存在且行数 > 0（只探测开头几行，不解析整个文件）
     def file_has_data(file_path):
-        file_path = Path(file_path)
-        return file_path.exists() and len(safe_read_csv(file_path)) > 0
+        return csv_has_rows(file_path)
 
 
 
     # LongPort
     if file_has_data(longport_trade_file) and file_has_data(longport_cash_file):
-        longport_data = user_longport.format_longport_trade(
+        longport_data = cached_call(
+            user_longport.format_longport_trade,
             longport_trade_file,
-            longport_cash_file
+            longport_cash_file,
+            method=cost_method,
+            checkpoint_dir=config.get("checkpoint_dir"),
+            multipliers=multipliers,
         )
         tabs.append(("长桥", longport_data, "每年已实现收益"))
 
@@ -169,23 +227,40 @@ if compute_btn:
         if not file_has_data(futu_cash_file):
             futu_cash_file = None
             st.warning("富途现金流水不存在，计算结果可能不准确")
-        futu_data = user_futu.format_trade(futu_trade_file, futu_cash_file)
+        futu_data = cached_call(
+            user_futu.format_trade, futu_trade_file, futu_cash_file,
+            check_date=datetime.combine(today, datetime.min.time()),
+            method=cost_method,
+            checkpoint_dir=config.get("checkpoint_dir"),
+            multipliers=multipliers)
         tabs.append(("富途", futu_data, "每年已实现收益"))
 
     # 合计：仅在两边都有数据时
     if len(tabs) == 2:
-        tabs.append(("合计", None, "每年已实现收益"))
-
-    if tabs:
-        tab_objs = st.tabs([t[0] for t in tabs])
-
-        for tab, (name, data, title) in zip(tab_objs, tabs):
-            with tab:
-                if name == "合计":
-                    combined = list(tabs[0][1].values()) + \
-                        list(tabs[1][1].values())
-                    show_yearly_bonus_by_currency(combined, title)
-                else:
-                    show_yearly_bonus_by_currency(data, title)
-    else:
-        st.info("未检测到可用的数据文件或文件为空，请先导入。")
+        tabs.append(("合计", combine(tabs[0][1], tabs[1][1]), "每年已实现收益"))
+
+    # 结果保存在 session_state 中，翻页、排序等操作触发重新运行时不必重新计算
+    st.session_state["results"] = [
+        (name, data, yearly_tables(data), title) for name, data, title in tabs]
+
+results = st.session_state.get("results")
+if results:
+    tab_objs = st.tabs([r[0] for r in results])
+
+    for tab, (name, data, tables, title) in zip(tab_objs, results):
+        with tab:
+            show_yearly_bonus_by_currency(tables, data, title, key=name)
+            show_base_currency_totals(long_table(data), title)
+elif results is not None:
+    st.info("未检测到可用的数据文件或文件为空，请先导入。")
+
+# -------- 性能指标 --------
+if st.sidebar.checkbox("显示性能指标", value=False):
+    spans, counters = metrics.summary()
+    with st.expander("⏱️ 性能指标", expanded=True):
+        if spans:
+            st.dataframe(pd.DataFrame(spans).set_index("name"), use_container_width=True)
+        if counters:
+            st.dataframe(pd.Series(counters, name="value").to_frame(), use_container_width=True)
+        if not spans and not counters:
+            st.caption("暂无记录")